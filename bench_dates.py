@@ -0,0 +1,42 @@
+import argparse
+import csv
+import functools
+import itertools
+import pathlib
+import time
+
+import dateutil.parser
+
+import ingest
+
+parser = argparse.ArgumentParser(description="Compare ingest.parse_date with the old dateutil based parser")
+parser.add_argument("--csv", default="build/contributions.csv", type=pathlib.Path)
+parser.add_argument("--column", default="receipt_date")
+parser.add_argument("--rows", default=1000000, type=int)
+args = parser.parse_args()
+
+
+# What update.py used before.
+@functools.lru_cache(512)
+def old_parse_date(value):
+    d = dateutil.parser.parse(value)
+    return d.date().isoformat()
+
+
+with args.csv.open(newline="") as f:
+    reader = csv.DictReader(f)
+    sample = [row[args.column] for row in itertools.islice(reader, args.rows) if row[args.column]]
+print(len(sample), "values,", len(set(sample)), "distinct")
+
+timings = {}
+for name, parse in (("dateutil", old_parse_date), ("parse_date", ingest.parse_date)):
+    start = time.perf_counter()
+    results = [parse(value) for value in sample]
+    timings[name] = time.perf_counter() - start
+    print(f"{name:>10}: {timings[name]:.3f}s ({len(sample) / timings[name]:.0f} values/sec)")
+# Counted now, the mismatch check below runs parse_date over the sample again.
+fallbacks = ingest.DATE_FALLBACKS.total()
+
+mismatches = [value for value in sample if old_parse_date(value) != ingest.parse_date(value)]
+print(f"{timings['dateutil'] / timings['parse_date']:.1f}x faster, {len(mismatches)} mismatches, "
+      f"{fallbacks} dateutil fallbacks")
@@ -0,0 +1,97 @@
+import argparse
+import pathlib
+import sqlite3
+import tempfile
+import time
+
+import ingest
+
+parser = argparse.ArgumentParser(description="Compare contributions with ENCODED_ROWS as ids against the same rows stored as strings")
+parser.add_argument("--db", default="raw.db")
+parser.add_argument("--names", default=500, type=int, help="Names to look up one at a time")
+parser.add_argument("--repeat", default=5, type=int)
+args = parser.parse_args()
+
+# Both copies get the indexes indexes.py puts on contributions.
+QUERIES = {
+    "totals by name": {
+        "strings": "SELECT contributor_name, SUM(amount) FROM contributions GROUP BY contributor_name",
+        "ids": """SELECT contributor_name, total FROM (
+                SELECT contributor_name_id, SUM(amount) AS total FROM contributions GROUP BY contributor_name_id) t
+            LEFT JOIN contributions_contributor_name ON contributions_contributor_name.id = t.contributor_name_id""",
+    },
+    "employer count": {
+        "strings": "SELECT COUNT(DISTINCT contributor_employer_name) FROM contributions",
+        "ids": "SELECT COUNT(DISTINCT contributor_employer_name_id) FROM contributions",
+    },
+    "recent by name": {
+        "strings": "SELECT receipt_date, amount FROM contributions WHERE contributor_name = ? ORDER BY receipt_date DESC LIMIT 20",
+        "ids": """SELECT receipt_date, amount FROM contributions_contributor_name
+            CROSS JOIN contributions ON contributor_name_id = contributions_contributor_name.id
+            WHERE contributions_contributor_name.contributor_name = ? ORDER BY receipt_date DESC LIMIT 20""",
+    },
+}
+
+
+def copy_ids(source, path):
+    con = sqlite3.connect(path)
+    con.execute("ATTACH DATABASE ? AS source", (f"file:{source}?mode=ro",))
+    with con:
+        con.execute("CREATE TABLE contributions AS SELECT * FROM source.contributions")
+        for field in ingest.ENCODED_ROWS:
+            con.execute(f"CREATE TABLE [contributions_{field}] ([id] INTEGER PRIMARY KEY, [{field}] TEXT)")
+            con.execute(f"INSERT INTO [contributions_{field}] SELECT * FROM source.[contributions_{field}]")
+            con.execute(f"CREATE UNIQUE INDEX [idx_{field}] ON [contributions_{field}] ([{field}])")
+        con.execute("CREATE INDEX idx_name ON contributions (contributor_name_id, receipt_date)")
+        con.execute("CREATE INDEX idx_employer ON contributions (contributor_employer_name_id, receipt_date)")
+    return con
+
+
+def copy_strings(source, path):
+    con = sqlite3.connect(path)
+    con.execute("ATTACH DATABASE ? AS source", (f"file:{source}?mode=ro",))
+    with con:
+        con.execute("CREATE TABLE contributions AS SELECT * FROM source.contributions_named")
+        con.execute("CREATE INDEX idx_name ON contributions (contributor_name, receipt_date)")
+        con.execute("CREATE INDEX idx_employer ON contributions (contributor_employer_name, receipt_date)")
+    return con
+
+
+def timed(con, sql, params):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        results = [con.execute(sql, p).fetchall() for p in params]
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, results
+
+
+with tempfile.TemporaryDirectory() as directory:
+    directory = pathlib.Path(directory)
+    source = pathlib.Path(args.db).resolve()
+    cons = {"strings": copy_strings(source, directory / "strings.db"), "ids": copy_ids(source, directory / "ids.db")}
+    names = [row[0] for row in cons["strings"].execute(
+        "SELECT contributor_name FROM contributions WHERE contributor_name IS NOT NULL GROUP BY contributor_name ORDER BY random() LIMIT ?", (args.names,))]
+
+    sizes = {}
+    for name, con in cons.items():
+        con.execute("DETACH DATABASE source")
+        con.execute("VACUUM")
+        sizes[name] = (directory / f"{name}.db").stat().st_size
+        print(f"{name:>8}: {sizes[name] / 1024 / 1024:.1f} MiB")
+    print(f"ids are {sizes['ids'] / sizes['strings']:.0%} of the size")
+
+    for query, sql in QUERIES.items():
+        params = [(name,) for name in names] if "?" in sql["strings"] else [()]
+        timings = {}
+        results = {}
+        for name, con in cons.items():
+            con.execute("PRAGMA cache_size = -200000")
+            timings[name], results[name] = timed(con, sql[name], params)
+        same = [sorted(r, key=repr) for r in results["strings"]] == [sorted(r, key=repr) for r in results["ids"]]
+        print(f"{query:>15}: strings {timings['strings'] * 1000:.1f}ms, ids {timings['ids'] * 1000:.1f}ms, "
+              f"{timings['strings'] / timings['ids']:.1f}x, {'same' if same else 'DIFFERENT'} results")
+
+    for con in cons.values():
+        con.close()
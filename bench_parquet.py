@@ -0,0 +1,70 @@
+import argparse
+import pathlib
+import sqlite3
+import time
+
+import pandas
+
+import export
+
+parser = argparse.ArgumentParser(description="Compare reading tables with read_sql_query against the update.py --export-parquet files")
+parser.add_argument("--db", default="raw.db")
+parser.add_argument("--parquet", default=export.DIRECTORY, type=pathlib.Path)
+parser.add_argument("--year", default=2022, type=int, help="Election year for the single partition read")
+parser.add_argument("--repeat", default=3, type=int)
+args = parser.parse_args()
+
+# The reads match_exp_cont.py does, plus one partition of contributions.
+READS = {
+    "matching contributions": (
+        "SELECT rowid, id, origin_id, amount, receipt_date, committee_id, contributor_name, contributor_address FROM contributions_named WHERE code_id >= 4 AND code_id <= 7 AND amount > 0",
+        (),
+        ("contributions", ["rowid", "id", "origin_id", "amount", "receipt_date", "committee_id", "contributor_name", "contributor_address"],
+         [("code_id", ">=", 4), ("code_id", "<=", 7), ("amount", ">", 0)]),
+    ),
+    "matching expenditures": (
+        "SELECT rowid, id, origin_id, amount, expenditure_date, committee_id, recipient_name, recipient_address FROM expenditures WHERE amount > 0",
+        (),
+        ("expenditures", ["rowid", "id", "origin_id", "amount", "expenditure_date", "committee_id", "recipient_name", "recipient_address"],
+         [("amount", ">", 0)]),
+    ),
+    "committees": (
+        "SELECT committee_id, filer_name, committee_address FROM registrations, registrations_filer_name WHERE registrations_filer_name.id = filer_name_id",
+        (),
+        ("registrations", ["committee_id", "filer_name", "committee_address"], None),
+    ),
+    "one year of contributions": (
+        "SELECT rowid, amount, receipt_date, filer_id, contributor_name, contributor_employer_name FROM contributions_named WHERE election_year = ?",
+        (args.year,),
+        ("contributions", ["rowid", "amount", "receipt_date", "filer_id", "contributor_name", "contributor_employer_name"],
+         [("election_year", "=", args.year)]),
+    ),
+}
+
+
+def best_of(read):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        frame = read()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, frame
+
+
+def megabytes(frame):
+    return frame.memory_usage(deep=True).sum() / 1024 / 1024
+
+
+con = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+db_size = pathlib.Path(args.db).stat().st_size
+parquet_size = sum(path.stat().st_size for path in args.parquet.glob("**/*.parquet"))
+print(f"raw.db {db_size / 1024 / 1024:.1f} MiB, parquet {parquet_size / 1024 / 1024:.1f} MiB")
+
+for name, (sql, params, (table, columns, filters)) in READS.items():
+    sql_time, sql_frame = best_of(lambda: pandas.read_sql_query(sql, con, params=params))
+    parquet_time, parquet_frame = best_of(lambda: export.read_table(table, columns, filters, directory=args.parquet))
+    same = len(sql_frame) == len(parquet_frame)
+    print(f"{name:>26}: {len(sql_frame)} rows, sql {sql_time:.3f}s {megabytes(sql_frame):.1f} MiB, "
+          f"parquet {parquet_time:.3f}s {megabytes(parquet_frame):.1f} MiB, {sql_time / parquet_time:.1f}x"
+          f"{'' if same else f', parquet has {len(parquet_frame)} rows'}")
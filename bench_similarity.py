@@ -0,0 +1,40 @@
+import argparse
+import csv
+import itertools
+import os
+import pathlib
+import time
+
+import pandas
+import recordlinkage
+
+import blocking
+import similarity
+
+parser = argparse.ArgumentParser(description="Compare similarity.Compare with recordlinkage.Compare")
+parser.add_argument("--csv", default="build/contributions.csv", type=pathlib.Path)
+parser.add_argument("--rows", default=20000, type=int, help="Distinct contributors to dedupe")
+parser.add_argument("--jobs", default=os.cpu_count(), type=int)
+args = parser.parse_args()
+
+with args.csv.open(newline="") as f:
+    reader = csv.DictReader(f)
+    records = {(row["contributor_name"], row["contributor_address"]) for row in itertools.islice(reader, args.rows * 10)}
+df = pandas.DataFrame(list(records)[:args.rows], columns=["contributor_name", "contributor_address"])
+candidates = blocking.candidates(df)
+print(len(df), "records,", len(candidates), "candidate pairs")
+
+features = {}
+timings = {}
+for name, compare in (("recordlinkage", recordlinkage.Compare()), ("similarity", similarity.Compare(jobs=args.jobs))):
+    # The same features test_recordlinkage.py uses.
+    compare.string("contributor_name", "contributor_name", method="levenshtein", label="contributor_name_lev")
+    compare.string("contributor_name", "contributor_name", method="jarowinkler", label="contributor_name_jw")
+    compare.string("contributor_address", "contributor_address", method="levenshtein", label="contributor_address_lev")
+    start = time.perf_counter()
+    features[name] = compare.compute(candidates, df)
+    timings[name] = time.perf_counter() - start
+    print(f"{name:>13}: {timings[name]:.3f}s ({len(candidates) / timings[name]:.0f} pairs/sec)")
+
+difference = (features["recordlinkage"] - features["similarity"]).abs().max().max()
+print(f"{timings['recordlinkage'] / timings['similarity']:.1f}x faster with {args.jobs} jobs, max difference {difference}")
@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import pathlib
+import platform
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas
+import recordlinkage
+
+import blocking
+import dedupe_runner
+import similarity
+import synthetic
+
+# Times the hot paths end to end on synthetic data, offline: update.py
+# ingest, static_build.py per page type, the sql() queries in the datasette
+# templates, serving pages through datasette, match_exp_cont.py transfer
+# matching and the dedupe comparisons.
+# Results are written as JSON so two commits can be compared with
+# --baseline.
+
+REPO = pathlib.Path(__file__).resolve().parent
+STEPS = ("ingest", "static_build", "queries", "serving", "matching", "comparisons")
+# What the work directory needs from the repo to run update.py,
+# static_build.py and datasette.
+LINKED = ("templates", "static", "plugins", "metadata.yml", "settings.json")
+# Slower than the baseline by more than this ratio, and by more than a
+# millisecond so timer noise on tiny queries isn't, is flagged.
+REGRESSION = 1.2
+NOISE = 0.001
+
+SQL_CALL = re.compile(r'sql\("((?:[^"\\]|\\.)*)"(?:,\s*\[(.*?)\])?\)')
+
+
+def run(workdir, *command):
+    result = subprocess.run([sys.executable, *map(str, command)], cwd=workdir, capture_output=True, text=True)
+    if result.returncode:
+        print(result.stdout[-5000:], result.stderr[-5000:])
+        raise RuntimeError(f"{' '.join(map(str, command))} failed")
+    return result.stdout
+
+
+def timed_run(seconds, name, workdir, *command):
+    start = time.perf_counter()
+    run(workdir, *command)
+    seconds[name] = time.perf_counter() - start
+    print(f"{name}: {seconds[name]:.2f}s")
+
+
+def best_of(repeat, function):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def bench_ingest(args, workdir, seconds, counts):
+    build = workdir / "build"
+    start = time.perf_counter()
+    synthetic.generate(build, args.rows, args.seed)
+    counts["generate_seconds"] = time.perf_counter() - start
+    counts["csv_bytes"] = sum(path.stat().st_size for path in build.glob("*.csv"))
+    timed_run(seconds, "ingest/full", workdir, REPO / "update.py", "--no-download")
+    timed_run(seconds, "ingest/incremental_unchanged", workdir, REPO / "update.py", "--no-download", "--incremental")
+    synthetic.generate(build, args.rows, args.seed, changed=0.01)
+    timed_run(seconds, "ingest/incremental_1pct", workdir, REPO / "update.py", "--no-download", "--incremental")
+    counts["db_bytes"] = (workdir / "raw.db").stat().st_size
+
+
+def bench_static_build(args, workdir, seconds, counts):
+    timed_run(seconds, "static_build/full", workdir, REPO / "static_build.py", "--force", "--jobs", args.jobs)
+    stats = json.loads((workdir / "build" / "site_manifest.json").read_text())["stats"]
+    for kind, kind_stats in stats["kinds"].items():
+        # Worker time, summed over the processes that rendered this kind.
+        seconds[f"static_build/{kind}"] = kind_stats["seconds"]
+        counts[f"static_build/{kind}_pages"] = kind_stats["rendered"]
+    timed_run(seconds, "static_build/unchanged", workdir, REPO / "static_build.py", "--jobs", args.jobs)
+
+
+def sample_params(db):
+    # The biggest donor, employer and filer stand in for the template
+    # variables, so each query is timed on one of its most expensive keys.
+    donor = db.execute("""SELECT contributor_name FROM contributor_year_totals WHERE contributor_name IS NOT NULL
+        GROUP BY contributor_name ORDER BY SUM(total) DESC LIMIT 1""").fetchone()
+    employer = db.execute("""SELECT contributor_employer_name FROM employer_year_totals WHERE contributor_employer_name NOT LIKE '%/%'
+        GROUP BY contributor_employer_name ORDER BY SUM(total) DESC LIMIT 1""").fetchone()
+    filer = db.execute("SELECT filer_id FROM filer_totals GROUP BY filer_id ORDER BY SUM(total) DESC LIMIT 1").fetchone()
+    return {
+        "donor_name": donor[0], "employer_name": employer[0],
+        "filer_id": filer[0], 'row["filer_id"]': filer[0],
+    }
+
+
+def template_queries(templates):
+    for path in sorted(templates.rglob("*.html")):
+        for i, match in enumerate(SQL_CALL.finditer(path.read_text())):
+            params = [p.strip() for p in match.group(2).split(",")] if match.group(2) else []
+            yield f"{path.relative_to(templates).as_posix()}#{i}", match.group(1).replace('\\"', '"'), params
+
+
+def bench_queries(args, workdir, seconds, counts):
+    db = sqlite3.connect(f"file:{workdir / 'raw.db'}?mode=ro", uri=True)
+    samples = sample_params(db)
+    for name, sql, params in template_queries(workdir / "templates"):
+        if not all(p in samples for p in params):
+            print(f"query/{name}: skipped, no sample for {params}")
+            continue
+        values = [samples[p] for p in params]
+        seconds[f"query/{name}"], rows = best_of(args.repeat, lambda: db.execute(sql, values).fetchall())
+        counts[f"query/{name}_rows"] = len(rows)
+        print(f"query/{name}: {seconds[f'query/{name}'] * 1000:.2f}ms")
+    db.close()
+
+
+def bench_serving(args, workdir, seconds, counts):
+    try:
+        from datasette.app import Datasette
+        from datasette.utils import tilde_encode
+    except ImportError:
+        print("datasette isn't installed, skipping serving")
+        return
+
+    db = sqlite3.connect(f"file:{workdir / 'raw.db'}?mode=ro", uri=True)
+    samples = sample_params(db)
+    # A donor and an employer too small for static pages are rendered by
+    # datasette from the templates.
+    small_donor = db.execute("""SELECT contributor_name FROM contributor_year_totals WHERE contributor_name IS NOT NULL
+        GROUP BY contributor_name ORDER BY SUM(total) LIMIT 1""").fetchone()[0]
+    small_employer = db.execute("""SELECT contributor_employer_name FROM employer_year_totals WHERE contributor_employer_name NOT LIKE '%/%'
+        GROUP BY contributor_employer_name ORDER BY SUM(total) LIMIT 1""").fetchone()[0]
+    db.close()
+    pages = {
+        "index": "/",
+        "donor": f"/donor/{tilde_encode(samples['donor_name'])}",
+        "small_donor": f"/donor/{tilde_encode(small_donor)}",
+        "employer": f"/employer/{tilde_encode(samples['employer_name'])}",
+        "small_employer": f"/employer/{tilde_encode(small_employer)}",
+        "raw_contributions": f"/raw/contributions_named?contributor_name__exact={tilde_encode(samples['donor_name'])}&_sort_desc=receipt_date",
+    }
+
+    async def serve():
+        datasette = Datasette([str(workdir / "raw.db")], config_dir=workdir)
+        for name, path in pages.items():
+            # The first request renders, the rest can come from page_cache.
+            start = time.perf_counter()
+            response = await datasette.client.get(path)
+            seconds[f"serving/{name}_cold"] = time.perf_counter() - start
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                await datasette.client.get(path)
+                duration = time.perf_counter() - start
+                best = duration if best is None else min(best, duration)
+            seconds[f"serving/{name}"] = best
+            counts[f"serving/{name}_status"] = response.status_code
+            print(f"serving/{name}: {response.status_code}, {seconds[f'serving/{name}_cold'] * 1000:.1f}ms cold, {best * 1000:.1f}ms after")
+
+    asyncio.run(serve())
+
+
+def bench_matching(args, workdir, seconds, counts):
+    timed_run(seconds, "matching/stream", workdir, REPO / "match_exp_cont.py", "--db", workdir / "raw.db", "--stream")
+    db = sqlite3.connect(f"file:{workdir / 'raw.db'}?mode=ro", uri=True)
+    counts["matching/matches"] = db.execute("SELECT COUNT(*) FROM matched_contributions").fetchone()[0]
+    # synthetic.py numbers the expenditures paired with a transfer after the
+    # rest, with 300000 and up report numbers.
+    counts["matching/paired"] = db.execute("SELECT COUNT(*) FROM expenditures WHERE report_number >= 300000").fetchone()[0]
+    db.close()
+    print(f"matching: {counts['matching/matches']} matches of {counts['matching/paired']} paired transfers")
+
+
+def bench_comparisons(args, workdir, seconds, counts):
+    db = sqlite3.connect(f"file:{workdir / 'raw.db'}?mode=ro", uri=True)
+    df = pandas.read_sql_query("""SELECT MIN(rowid) AS rowid, contributor_name, contributor_address FROM contributions_named
+        GROUP BY contributor_name, contributor_address ORDER BY rowid LIMIT ?""", db, index_col="rowid", params=(args.compare_rows,))
+    db.close()
+    seconds["compare/blocking"], pairs = best_of(1, lambda: blocking.candidates(df))
+    counts["compare/records"] = len(df)
+    counts["compare/pairs"] = len(pairs)
+
+    # The features dedupe_runner.py scores pairs with.
+    features = dedupe_runner.comparer().features
+    for name, compare in (("similarity", similarity.Compare(jobs=args.jobs)), ("recordlinkage", recordlinkage.Compare())):
+        for left_on, right_on, method, label, missing_value in features:
+            compare.string(left_on, right_on, method=method, label=label, missing_value=missing_value)
+        seconds[f"compare/{name}"], _ = best_of(1, lambda: compare.compute(pairs, df))
+    print(f"compare: {len(pairs)} pairs of {len(df)} records, similarity {seconds['compare/similarity']:.2f}s, "
+          f"recordlinkage {seconds['compare/recordlinkage']:.2f}s")
+
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "static_build": bench_static_build,
+    "queries": bench_queries,
+    "serving": bench_serving,
+    "matching": bench_matching,
+    "comparisons": bench_comparisons,
+}
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def compare_to(baseline, seconds):
+    print(f"Compared to {baseline.get('commit')} at {baseline['rows']} rows:")
+    for name, now in seconds.items():
+        before = baseline["seconds"].get(name)
+        if not before or not now:
+            continue
+        ratio = now / before
+        flag = ""
+        if abs(now - before) > NOISE:
+            flag = "  slower" if ratio > REGRESSION else "  faster" if ratio < 1 / REGRESSION else ""
+        print(f"{name:>60}: {before:10.4f}s -> {now:10.4f}s {ratio:5.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, site build, serving and matching on synthetic data")
+    parser.add_argument("--rows", type=int, default=100000, help="Synthetic contributions, 10000 to 10000000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--steps", nargs="+", choices=STEPS, default=STEPS, help="Later steps need ingest to have run in --workdir")
+    parser.add_argument("--workdir", type=pathlib.Path, help="Keep the generated data and raw.db here instead of a temporary directory")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each query and page, the fastest is kept")
+    parser.add_argument("--compare-rows", type=int, default=20000, help="Distinct contributors to compare")
+    parser.add_argument("--output", type=pathlib.Path, default=pathlib.Path("build") / "benchmark.json")
+    parser.add_argument("--baseline", type=pathlib.Path, help="An earlier --output to compare against")
+    args = parser.parse_args()
+
+    temporary = None
+    if args.workdir is None:
+        temporary = tempfile.TemporaryDirectory(prefix="campaign-funds-benchmark-")
+        workdir = pathlib.Path(temporary.name)
+    else:
+        workdir = args.workdir.resolve()
+        workdir.mkdir(parents=True, exist_ok=True)
+    for name in LINKED:
+        link = workdir / name
+        if not link.exists() and (REPO / name).exists():
+            link.symlink_to(REPO / name)
+
+    seconds = {}
+    counts = {}
+    try:
+        for step in STEPS:
+            if step in args.steps:
+                BENCHMARKS[step](args, workdir, seconds, counts)
+    finally:
+        if temporary:
+            temporary.cleanup()
+
+    results = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "rows": args.rows,
+        "seed": args.seed,
+        "jobs": args.jobs,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "seconds": seconds,
+        "counts": counts,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=1, sort_keys=True))
+    print("Wrote", args.output)
+    if args.baseline:
+        compare_to(json.loads(args.baseline.read_text()), seconds)
+
+
+if __name__ == "__main__":
+    main()
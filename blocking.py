@@ -0,0 +1,101 @@
+import re
+
+import recordlinkage
+
+# Candidate pair generation for contributor deduplication. A full index
+# compares every pair of records, which is quadratic. Instead we union a few
+# cheap blocking passes that each catch a different kind of duplicate:
+#
+# * name_key: soundex of the first and last name tokens, in either order, so
+#   "SMITH JOHN" and "JON SMITH" land together.
+# * street_key: house number plus the first word of the street name, so
+#   "126 NW CANAL ST" and "126 N.W. CANAL STREET" land together.
+# * sorted neighbourhood on the name for typos the phonetic key misses.
+
+SOUNDEX_CODES = {}
+for letters, code in (("BFPV", "1"), ("CGJKQSXZ", "2"), ("DT", "3"), ("L", "4"), ("MN", "5"), ("R", "6")):
+    for letter in letters:
+        SOUNDEX_CODES[letter] = code
+
+DIRECTIONS = {"N", "S", "E", "W", "NE", "NW", "SE", "SW", "NORTH", "SOUTH", "EAST", "WEST"}
+
+SORTED_NEIGHBOURHOOD_WINDOW = 7
+
+
+def soundex(word):
+    word = word.upper()
+    if not word:
+        return ""
+    codes = [word[0]]
+    last = SOUNDEX_CODES.get(word[0])
+    for letter in word[1:]:
+        code = SOUNDEX_CODES.get(letter)
+        if code and code != last:
+            codes.append(code)
+        # H and W don't separate letters with the same code, vowels do.
+        if letter not in "HW":
+            last = code
+    return ("".join(codes) + "000")[:4]
+
+
+def name_key(name):
+    if not isinstance(name, str):
+        return None
+    tokens = re.findall(r"[A-Z]+", name.upper())
+    if not tokens:
+        return None
+    return " ".join(sorted({soundex(tokens[0]), soundex(tokens[-1])}))
+
+
+def street_key(address):
+    if not isinstance(address, str):
+        return None
+    tokens = re.findall(r"[A-Z0-9]+", address.upper())
+    if len(tokens) < 2 or not tokens[0].isdigit():
+        return None
+    for token in tokens[1:]:
+        if token not in DIRECTIONS:
+            return f"{tokens[0]} {token}"
+    return None
+
+
+def add_keys(df, name="contributor_name", address="contributor_address"):
+    df = df.copy()
+    df["name_key"] = df[name].map(name_key)
+    df["street_key"] = df[address].map(street_key)
+    return df
+
+
+def candidates(df, name="contributor_name", address="contributor_address", window=SORTED_NEIGHBOURHOOD_WINDOW):
+    keyed = add_keys(df, name, address)
+    indexer = recordlinkage.Index()
+    indexer.block("name_key")
+    indexer.block("street_key")
+    indexer.sortedneighbourhood(name, window=window)
+    return indexer.index(keyed)
+
+
+def unordered(pairs):
+    return {frozenset(pair) for pair in pairs}
+
+
+def align(pairs, candidate_pairs):
+    # Annotation pairs may be stored in the opposite order from the
+    # candidates. Return the ones we generated, in candidate order.
+    wanted = unordered(pairs)
+    return candidate_pairs[[frozenset(pair) in wanted for pair in candidate_pairs]]
+
+
+def report(candidate_pairs, record_count, golden_paths):
+    full = record_count * (record_count - 1) // 2
+    found = unordered(candidate_pairs)
+    print(f"{len(candidate_pairs)} candidate pairs out of {full} "
+          f"({1 - len(candidate_pairs) / max(full, 1):.4%} reduction)")
+    results = {"pairs": len(candidate_pairs), "full_pairs": full, "recall": {}}
+    for path in golden_paths:
+        links = unordered(recordlinkage.read_annotation_file(path).links)
+        recall = len(links & found) / max(len(links), 1)
+        results["recall"][str(path)] = recall
+        print(f"{path}: {len(links & found)} of {len(links)} known matches kept ({recall:.1%} recall)")
+    return results
+
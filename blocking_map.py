@@ -0,0 +1,94 @@
+import itertools
+import time
+
+# Out of core blocking for test_dedupe.py. Fingerprints go into a
+# (block_key, rowid) primary key in sorted batches, blocks bigger than a cap
+# are dropped, and candidate pairs are streamed one block at a time in key
+# order instead of self joining blocking_map. A pair that shares several
+# blocks is only emitted from the first of them, so nothing has to remember
+# which pairs were already produced.
+
+BATCH_SIZE = 100000
+MAX_BLOCK_SIZE = 1000
+CHUNK_SIZE = 50000
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def write_blocking_map(con, fingerprints, batch_size=BATCH_SIZE):
+    # Sorting each batch keeps inserts into the primary key b-tree local.
+    start = time.monotonic()
+    with con:
+        con.execute("DROP TABLE IF EXISTS blocking_map")
+        con.execute("CREATE TABLE blocking_map (block_key TEXT, rowid INTEGER, PRIMARY KEY (block_key, rowid)) WITHOUT ROWID")
+    count = 0
+    for batch in batches(fingerprints, batch_size):
+        batch.sort()
+        with con:
+            con.executemany("INSERT OR IGNORE INTO blocking_map VALUES (?, ?)", batch)
+        count += len(batch)
+    print(f"Wrote {count} fingerprints in {time.monotonic() - start:.1f}s")
+    return count
+
+
+def drop_oversized_blocks(con, max_block_size=MAX_BLOCK_SIZE):
+    # A block of n records is n * (n - 1) / 2 pairs, so one common key can
+    # cost more than all the others put together.
+    oversized = con.execute("""SELECT COUNT(*), SUM(size) FROM (
+        SELECT COUNT(*) AS size FROM blocking_map GROUP BY block_key HAVING size > ?)""", (max_block_size,)).fetchone()
+    with con:
+        con.execute("""DELETE FROM blocking_map WHERE block_key IN (
+            SELECT block_key FROM blocking_map GROUP BY block_key HAVING COUNT(*) > ?)""", (max_block_size,))
+    return {"skipped_blocks": oversized[0], "skipped_fingerprints": oversized[1] or 0}
+
+
+def index_blocks(con):
+    # Number the blocks with more than one record in key order and list the
+    # blocks each record is in, so the stream can tell whether two records
+    # already met in an earlier block.
+    with con:
+        con.execute("DROP TABLE IF EXISTS temp.plural_blocks")
+        con.execute("""CREATE TEMP TABLE plural_blocks (block_key TEXT PRIMARY KEY, block_id INTEGER)""")
+        con.execute("""INSERT INTO temp.plural_blocks SELECT block_key, row_number() OVER (ORDER BY block_key) FROM (
+            SELECT block_key FROM blocking_map GROUP BY block_key HAVING COUNT(*) > 1)""")
+        con.execute("DROP TABLE IF EXISTS temp.covered_blocks")
+        con.execute("""CREATE TEMP TABLE covered_blocks (rowid INTEGER PRIMARY KEY, block_ids TEXT)""")
+        con.execute("""INSERT INTO temp.covered_blocks SELECT rowid, group_concat(block_id) FROM (
+            SELECT m.rowid, b.block_id FROM blocking_map m JOIN temp.plural_blocks b USING (block_key) ORDER BY m.rowid, b.block_id)
+            GROUP BY rowid""")
+        # Filled per chunk by record_pair_chunks(). Created here because
+        # tables can't be dropped while candidate_pairs() is reading.
+        con.execute("DROP TABLE IF EXISTS temp.chunk_ids")
+        con.execute("CREATE TEMP TABLE chunk_ids (rowid INTEGER PRIMARY KEY)")
+    return con.execute("SELECT COUNT(*) FROM temp.plural_blocks").fetchone()[0]
+
+
+def candidate_pairs(con, stats):
+    cursor = con.execute("""SELECT b.block_id, m.rowid, c.block_ids FROM blocking_map m
+        JOIN temp.plural_blocks b USING (block_key)
+        JOIN temp.covered_blocks c ON c.rowid = m.rowid
+        ORDER BY m.block_key, m.rowid""")
+    for block_id, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+        members = [(rowid, {int(i) for i in block_ids.split(",") if int(i) < block_id}) for _, rowid, block_ids in rows]
+        stats["blocks"] += 1
+        for (a, earlier_a), (b, earlier_b) in itertools.combinations(members, 2):
+            if earlier_a.isdisjoint(earlier_b):
+                stats["pairs"] += 1
+                yield a, b
+
+
+def record_pair_chunks(con, pairs, fields, table="contributions", chunk_size=CHUNK_SIZE):
+    # Looks records up a chunk of pairs at a time so only chunk_size pairs
+    # and their records are in memory.
+    columns = ", ".join(fields)
+    for chunk in batches(pairs, chunk_size):
+        ids = {rowid for pair in chunk for rowid in pair}
+        con.execute("DELETE FROM temp.chunk_ids")
+        con.executemany("INSERT INTO temp.chunk_ids VALUES (?)", ((rowid,) for rowid in ids))
+        cursor = con.execute(f"SELECT [{table}].rowid, {columns} FROM temp.chunk_ids CROSS JOIN [{table}] ON [{table}].rowid = temp.chunk_ids.rowid")
+        records = {row[0]: dict(zip(fields, row[1:])) for row in cursor}
+        yield [((a, records[a]), (b, records[b])) for a, b in chunk]
@@ -1,4 +0,0 @@
-sqlite-utils create-index raw.db contributions filer_id
-sqlite-utils create-index raw.db contributions contributor_name
-sqlite-utils create-index raw.db contributions election_year
-sqlite-utils create-index raw.db expenditures filer_id
@@ -0,0 +1,187 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import time
+
+import pandas
+
+import blocking
+import similarity
+
+# Statewide contributor deduplication. Contributors are sharded by zip code
+# (or its first three digits), each shard is blocked, compared and clustered
+# in a worker process, and the clusters are written to entity_map as each
+# shard finishes. Finished shards are recorded in entity_map_shards in the
+# same transaction so a crashed run picks up where it left off.
+
+# Features are in [0, 1] so this is a sum over the three comparisons, the
+# same cut off test_recordlinkage.py uses without training data.
+THRESHOLD = 2.5
+
+SHARD_DIGITS = {"zip": 5, "zip3": 3}
+
+
+def create_tables(con):
+    with con:
+        con.execute("""CREATE TABLE IF NOT EXISTS entity_map (
+            donor_id INTEGER PRIMARY KEY,
+            canon_id INTEGER,
+            cluster_score REAL,
+            shard TEXT,
+            contributor_name TEXT,
+            contributor_address TEXT,
+            contributor_zip INTEGER
+        )""")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_entity_map_canon_id ON entity_map (canon_id)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_entity_map_shard ON entity_map (shard)")
+        con.execute("""CREATE TABLE IF NOT EXISTS entity_map_shards (
+            shard TEXT PRIMARY KEY,
+            records INTEGER,
+            pairs INTEGER,
+            matches INTEGER,
+            clusters INTEGER,
+            seconds REAL
+        )""")
+
+
+def finished_shards(con):
+    return {row[0] for row in con.execute("SELECT shard FROM entity_map_shards")}
+
+
+def shard_records(con, digits):
+    # One pass over contributions for every shard. Each distinct name and
+    # address is one record, identified by its lowest contributions rowid.
+    # Grouping is on the integer ids, the strings are looked up after.
+    cursor = con.execute(f"""SELECT shard, first_rowid, n.contributor_name, a.contributor_address, zip FROM (
+            SELECT coalesce(substr(contributor_zip, 1, {digits}), '') AS shard, MIN(rowid) AS first_rowid,
+                   contributor_name_id, contributor_address_id, MIN(contributor_zip) AS zip
+            FROM contributions
+            GROUP BY shard, contributor_name_id, contributor_address_id) t
+        LEFT JOIN contributions_contributor_name n ON n.id = t.contributor_name_id
+        LEFT JOIN contributions_contributor_address a ON a.id = t.contributor_address_id
+        ORDER BY shard""")
+    for shard, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+        yield shard, [row[1:] for row in rows]
+
+
+def comparer():
+    # Shards already run in parallel so each one compares serially.
+    compare = similarity.Compare()
+    compare.string("contributor_name", "contributor_name", method="levenshtein", label="contributor_name_lev")
+    compare.string("contributor_name", "contributor_name", method="jarowinkler", label="contributor_name_jw")
+    compare.string("contributor_address", "contributor_address", method="levenshtein", label="contributor_address_lev")
+    return compare
+
+
+def find(canon, record_id):
+    while canon[record_id] != record_id:
+        canon[record_id] = canon[canon[record_id]]
+        record_id = canon[record_id]
+    return record_id
+
+
+def union(canon, a, b):
+    # The same connected components as recordlinkage.ConnectedComponents
+    # without needing networkx. The lower id becomes the canonical one.
+    a = find(canon, a)
+    b = find(canon, b)
+    if a != b:
+        canon[max(a, b)] = min(a, b)
+
+
+def dedupe_shard(task):
+    shard, records, threshold = task
+    start = time.monotonic()
+    df = pandas.DataFrame.from_records(records, columns=["rowid", "contributor_name", "contributor_address", "contributor_zip"], index="rowid")
+    canon = {record_id: record_id for record_id in df.index}
+    scores = {}
+    pairs = 0
+    matches = []
+    if len(df) > 1:
+        candidates = blocking.candidates(df)
+        pairs = len(candidates)
+        if pairs:
+            features = comparer().compute(candidates, df)
+            total = features.sum(axis=1)
+            matched = total[total > threshold]
+            matches = matched.index
+            # A record's score is its best link, scaled to [0, 1].
+            for (a, b), score in (matched / len(features.columns)).items():
+                scores[a] = max(scores.get(a, 0), score)
+                scores[b] = max(scores.get(b, 0), score)
+                union(canon, a, b)
+    # Flatten so every record points straight at its cluster's lowest id.
+    for record_id in canon:
+        canon[record_id] = find(canon, record_id)
+    rows = [(int(record_id), int(canon[record_id]), float(scores.get(record_id, 1.0)), shard, name, address, zip_code)
+            for record_id, (name, address, zip_code) in df.iterrows()]
+    clusters = len(set(canon.values()))
+    return shard, rows, {"records": len(df), "pairs": pairs, "matches": len(matches), "clusters": clusters,
+                         "seconds": time.monotonic() - start}
+
+
+def save_shard(con, shard, rows, stats):
+    # Results and checkpoint commit together so a shard is either done or
+    # redone from scratch.
+    with con:
+        con.execute("DELETE FROM entity_map WHERE shard = ?", (shard,))
+        con.executemany("INSERT INTO entity_map VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        con.execute("INSERT OR REPLACE INTO entity_map_shards VALUES (?, ?, ?, ?, ?, ?)",
+                    (shard, stats["records"], stats["pairs"], stats["matches"], stats["clusters"], stats["seconds"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate contributors into entity_map")
+    parser.add_argument("--db", default="raw.db")
+    parser.add_argument("--shard-by", choices=SHARD_DIGITS, default="zip", help="Partition contributors by zip or the first three digits of it")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Worker processes to dedupe with. 1 runs serially.")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Minimum summed similarity for two records to match")
+    parser.add_argument("--restart", action="store_true", help="Throw away finished shards and start over")
+    args = parser.parse_args()
+
+    con = sqlite3.connect(args.db)
+    if args.restart:
+        with con:
+            con.execute("DROP TABLE IF EXISTS entity_map")
+            con.execute("DROP TABLE IF EXISTS entity_map_shards")
+    create_tables(con)
+    done = finished_shards(con)
+    if done:
+        print(f"Resuming, {len(done)} shards already finished")
+
+    digits = SHARD_DIGITS[args.shard_by]
+    start = time.monotonic()
+    tasks = [(shard, records, args.threshold) for shard, records in shard_records(con, digits) if shard not in done]
+    print(f"Loaded {sum(len(t[1]) for t in tasks)} records in {len(tasks)} shards in {time.monotonic() - start:.1f}s")
+
+    # Big shards first so one doesn't run alone at the end.
+    tasks.sort(key=lambda task: len(task[1]), reverse=True)
+    if args.jobs == 1:
+        results = map(dedupe_shard, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap_unordered(dedupe_shard, tasks)
+
+    start = time.monotonic()
+    totals = {"records": 0, "pairs": 0, "matches": 0, "clusters": 0, "seconds": 0}
+    for i, (shard, rows, stats) in enumerate(results, 1):
+        save_shard(con, shard, rows, stats)
+        for key in totals:
+            totals[key] += stats[key]
+        print(f"[{i}/{len(tasks)}] shard {shard or '(no zip)'}: {stats['records']} records, {stats['pairs']} pairs, "
+              f"{stats['matches']} matches, {stats['clusters']} clusters in {stats['seconds']:.1f}s")
+    if pool:
+        pool.close()
+        pool.join()
+    duration = time.monotonic() - start
+
+    print(f"Deduplicated {totals['records']} records into {totals['clusters']} entities from {totals['pairs']} pairs "
+          f"in {duration:.1f}s with {args.jobs} jobs ({totals['seconds']:.1f}s of worker time)")
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import concurrent.futures
+import http.client
+import json
+import os
+import shutil
+import urllib.error
+import urllib.request
+
+CHUNK_SIZE = 1 << 20
+
+
+def _meta_path(path):
+    return path.with_name(path.name + ".meta.json")
+
+
+def _part_path(path):
+    return path.with_name(path.name + ".part")
+
+
+def _load_meta(path, url):
+    try:
+        meta = json.loads(_meta_path(path).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    # Validators from a different URL don't tell us anything.
+    if meta.get("url") != url:
+        return {}
+    return meta
+
+
+def _save_meta(path, meta):
+    tmp = _meta_path(path).with_suffix(".tmp")
+    tmp.write_text(json.dumps(meta, indent=1))
+    os.replace(tmp, _meta_path(path))
+
+
+def _validators(response):
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+# Returns "unchanged", "resumed" or "downloaded".
+def fetch(url, path, timeout=60):
+    meta = _load_meta(path, url)
+    part = _part_path(path)
+    headers = {}
+    partial = meta.get("partial", {})
+    resume_from = part.stat().st_size if part.exists() else 0
+    if resume_from and (partial.get("etag") or partial.get("last_modified")):
+        headers["Range"] = f"bytes={resume_from}-"
+        headers["If-Range"] = partial.get("etag") or partial["last_modified"]
+    elif path.exists():
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return "unchanged"
+        if e.code == 416:
+            # Our partial file doesn't fit the current resource. Start over.
+            part.unlink()
+            meta.pop("partial", None)
+            _save_meta(path, meta)
+            return fetch(url, path, timeout)
+        raise
+
+    with response:
+        if response.status == 206:
+            mode = "ab"
+            status = "resumed"
+        else:
+            # Either a fresh download or the server ignored our Range because
+            # the resource changed.
+            mode = "wb"
+            status = "downloaded"
+            meta["partial"] = _validators(response)
+            meta["url"] = url
+            _save_meta(path, meta)
+        with part.open(mode) as f:
+            shutil.copyfileobj(response, f, CHUNK_SIZE)
+        # Reads in chunks don't notice a body that ends early. The .part is
+        # kept so the next run resumes it.
+        length = response.headers.get("Content-Length")
+        received = part.stat().st_size - (resume_from if status == "resumed" else 0)
+        if length is not None and received < int(length):
+            raise http.client.IncompleteRead(b"", int(length) - received)
+        validators = meta.pop("partial", None) or _validators(response)
+
+    os.replace(part, path)
+    meta.update(validators)
+    meta["url"] = url
+    _save_meta(path, meta)
+    return status
+
+
+def fetch_all(sources, directory, max_workers=4, timeout=60):
+    directory.mkdir(parents=True, exist_ok=True)
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch, url, directory / filename, timeout): filename
+                   for filename, url in sources.items()}
+        for future in concurrent.futures.as_completed(futures):
+            filename = futures[future]
+            try:
+                results[filename] = future.result()
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                # Keep going with whatever copy we already have.
+                if not (directory / filename).exists():
+                    raise
+                print("Failed to download", filename, e)
+                results[filename] = "failed"
+            print(filename, results[filename])
+    return results
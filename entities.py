@@ -0,0 +1,101 @@
+import time
+
+import indexes
+import ingest
+
+# Canonical donors. dedupe_runner.py clusters distinct contributor name and
+# address pairs into entity_map; this maps every contribution onto its
+# cluster once so donor pages and totals group by an integer donor_id
+# instead of the raw contributor_name string. Contributions that
+# match_exp_cont.py --stream paired with an expenditure are committee to
+# committee transfers and are left out of donor totals so the money isn't
+# counted twice.
+
+# entity_map stores the zip prefix it was sharded on, '' for no zip.
+ENTITY_MATCH = """e.name_id IS c.contributor_name_id AND e.address_id IS c.contributor_address_id
+    AND CASE WHEN e.shard = '' THEN c.contributor_zip IS NULL ELSE substr(c.contributor_zip, 1, length(e.shard)) = e.shard END"""
+
+ENTITY_ROLLUPS = {
+    "donor_totals": "SELECT donor_id, MAX(code_id) AS code_id, election_year, SUM(amount) AS total_amount FROM {donations} GROUP BY donor_id, election_year",
+    "donor_filer_totals": "SELECT donor_id, filer_id, MAX(code_id) AS code_id, MAX(type_id) AS type_id, MAX(filer_name_id) AS filer_name_id, SUM(amount) AS total FROM {donations} GROUP BY donor_id, filer_id",
+    "donor_year_totals": "SELECT donor_id, strftime('%Y', receipt_date) AS year, SUM(amount) AS total FROM {donations} GROUP BY donor_id, year",
+}
+
+# Contributions with a donor, one rowid lookup each. DONATIONS leaves out
+# transfers.
+MAPPED = "contribution_donors d CROSS JOIN contributions ON contributions.rowid = d.contribution_rowid WHERE d.donor_id IS NOT NULL"
+DONATIONS = MAPPED + " AND NOT d.is_transfer"
+
+ENTITY_TABLES = ("contribution_donors", "donors", "donor_names") + tuple(ENTITY_ROLLUPS)
+
+
+def build_contribution_donors(con):
+    transfers = "0"
+    if ingest.table_exists(con, "matched_contributions"):
+        # Older tables were keyed by rowids that a full update.py run
+        # renumbers, so they can't be trusted.
+        if "contribution_id" in {row[1] for row in con.execute("PRAGMA table_info(matched_contributions)")}:
+            transfers = "c.id IN (SELECT contribution_id FROM matched_contributions)"
+        else:
+            print("matched_contributions is keyed by rowid, rerun match_exp_cont.py --stream to leave out transfers")
+    with con:
+        # Swap entity_map's strings for the ids contributions stores so the
+        # big join compares integers.
+        con.execute("DROP TABLE IF EXISTS temp.entity_ids")
+        con.execute("""CREATE TEMP TABLE entity_ids AS
+            SELECT n.id AS name_id, a.id AS address_id, e.shard, e.canon_id FROM entity_map e
+            LEFT JOIN contributions_contributor_name n ON n.contributor_name = e.contributor_name
+            LEFT JOIN contributions_contributor_address a ON a.contributor_address = e.contributor_address""")
+        con.execute("CREATE INDEX temp.idx_entity_ids ON entity_ids (name_id, address_id)")
+        con.execute("DROP TABLE IF EXISTS contribution_donors")
+        con.execute("CREATE TABLE contribution_donors (contribution_rowid INTEGER PRIMARY KEY, donor_id INTEGER, is_transfer INTEGER)")
+        con.execute(f"""INSERT OR IGNORE INTO contribution_donors
+            SELECT c.rowid, e.canon_id, {transfers} FROM contributions c LEFT JOIN temp.entity_ids e ON {ENTITY_MATCH}""")
+        con.execute("DROP TABLE temp.entity_ids")
+    return con.execute("SELECT COUNT(*), COUNT(donor_id), SUM(is_transfer) FROM contribution_donors").fetchone()
+
+
+def build_donors(con):
+    # A donor is shown under the name it used most. A name used by more than
+    # one donor links to the one that used it most.
+    with con:
+        con.execute("DROP TABLE IF EXISTS temp.donor_name_counts")
+        con.execute(f"""CREATE TEMP TABLE donor_name_counts AS
+            SELECT donor_id, contributor_name, contributions FROM (
+                SELECT donor_id, contributor_name_id, COUNT(*) AS contributions FROM {MAPPED} GROUP BY donor_id, contributor_name_id) t
+            LEFT JOIN contributions_contributor_name ON contributions_contributor_name.id = t.contributor_name_id""")
+        con.execute("DROP TABLE IF EXISTS donors")
+        con.execute("CREATE TABLE donors (donor_id INTEGER PRIMARY KEY, contributor_name TEXT, names INTEGER, contributions INTEGER)")
+        con.execute("""INSERT INTO donors SELECT donor_id, contributor_name, names, total FROM (
+            SELECT donor_id, contributor_name, COUNT(*) OVER w AS names, SUM(contributions) OVER w AS total,
+                   row_number() OVER (PARTITION BY donor_id ORDER BY contributions DESC, contributor_name) AS n
+            FROM temp.donor_name_counts WINDOW w AS (PARTITION BY donor_id)) WHERE n = 1""")
+        con.execute("DROP TABLE IF EXISTS donor_names")
+        con.execute("CREATE TABLE donor_names (contributor_name TEXT PRIMARY KEY, donor_id INTEGER)")
+        con.execute("""INSERT INTO donor_names SELECT contributor_name, donor_id FROM (
+            SELECT contributor_name, donor_id, row_number() OVER (PARTITION BY contributor_name ORDER BY contributions DESC, donor_id) AS n
+            FROM temp.donor_name_counts WHERE contributor_name IS NOT NULL) WHERE n = 1""")
+        con.execute("DROP TABLE temp.donor_name_counts")
+
+
+def build_entities(con):
+    if not ingest.table_exists(con, "entity_map"):
+        print("No entity_map, run dedupe_runner.py to build canonical donors")
+        return False
+
+    start = time.monotonic()
+    contributions, mapped, transfers = build_contribution_donors(con)
+    print(f"Mapped {mapped} of {contributions} contributions to donors, {transfers or 0} are transfers, in {time.monotonic() - start:.1f}s")
+    indexes.build_indexes(con, ("contribution_donors",))
+
+    start = time.monotonic()
+    build_donors(con)
+    print(f"Built donors in {time.monotonic() - start:.1f}s")
+
+    for name, select in ENTITY_ROLLUPS.items():
+        start = time.monotonic()
+        with con:
+            con.execute(f"DROP TABLE IF EXISTS [{name}]")
+            con.execute(f"CREATE TABLE [{name}] AS {select.format(donations=DONATIONS)}")
+        print(f"Built {name} in {time.monotonic() - start:.1f}s")
+    return True
@@ -0,0 +1,158 @@
+import pathlib
+import shutil
+import time
+
+import numpy
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet
+
+import ingest
+
+# Parquet copies of the cleaned tables for the analysis scripts, one
+# directory per table partitioned by election_year:
+#
+#   build/parquet/contributions/election_year=2022/data.parquet
+#
+# Each table keeps its own columns, and every lookup id column also gets the
+# string it stands for under the original column name, so filer_name and
+# contributor_name can be read without joining the lookup tables. Parquet
+# dictionary encodes the strings on disk and read_table() loads the lookup
+# columns back as dictionaries, which pandas turns into categoricals.
+
+DIRECTORY = pathlib.Path("build/parquet")
+TABLES = ("contributions", "expenditures", "registrations")
+BATCH_SIZE = 100000
+PARTITION = "election_year"
+# What pyarrow reads a null partition value from.
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+ARROW_TYPES = {"INTEGER": pyarrow.int64(), "REAL": pyarrow.float64(), "TEXT": pyarrow.string()}
+
+
+def table_schema(con, table):
+    # Column names and arrow types from the declared SQLite types. Dates are
+    # declared INTEGER but hold ISO strings.
+    columns = []
+    for _, name, declared, *_ in con.execute(f"PRAGMA table_info([{table}])"):
+        if name == "row_hash":
+            continue
+        columns.append((name, pyarrow.string() if name in ingest.DATE_ROWS else ARROW_TYPES[declared.split()[0]]))
+    return columns
+
+
+class Lookup:
+    # Turns a column of lookup ids into the strings they stand for.
+    def __init__(self, con, table, field):
+        rows = con.execute(f"SELECT [id], [{field}] FROM [{table}_{field}] ORDER BY [id]").fetchall()
+        ids = numpy.array([row[0] for row in rows], dtype=numpy.int64)
+        self.positions = numpy.full(ids.max() + 1 if len(ids) else 1, -1, dtype=numpy.int64)
+        self.positions[ids] = numpy.arange(len(ids))
+        self.values = pyarrow.array([row[1] for row in rows], pyarrow.string())
+
+    def __call__(self, ids):
+        ids = ids.to_numpy(zero_copy_only=False)
+        missing = numpy.isnan(ids) if ids.dtype.kind == "f" else numpy.zeros(len(ids), dtype=bool)
+        ids = numpy.where(missing, 0, ids).astype(numpy.int64)
+        # Ids without a lookup row come out null too.
+        positions = self.positions[numpy.clip(ids, 0, len(self.positions) - 1)]
+        positions[ids >= len(self.positions)] = -1
+        return self.values.take(pyarrow.array(positions, mask=missing | (positions < 0)))
+
+
+def typed_array(values, type):
+    # ingest keeps the raw text when a value doesn't convert, like a zip of
+    # 98107-1234 in an INTEGER column. Those become nulls, counted.
+    try:
+        return pyarrow.array(values, type), 0
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        kinds = (int,) if pyarrow.types.is_integer(type) else (int, float)
+        kept = [v if v is None or (isinstance(v, kinds) and not isinstance(v, bool)) else None for v in values]
+        return pyarrow.array(kept, type), sum(v is not None for v in values) - sum(v is not None for v in kept)
+
+
+def partition_path(directory, year):
+    return directory / f"{PARTITION}={NULL_PARTITION if year is None else year}" / "data.parquet"
+
+
+def export_table(con, table, directory, batch_size=BATCH_SIZE):
+    columns = table_schema(con, table)
+    names = [name for name, _ in columns]
+    lookups = {}
+    for field in ingest.DICTIONARY_ROWS:
+        if f"{field}_id" in names:
+            lookups[field] = Lookup(con, table, field)
+    # The year is in the directory name, not the files.
+    year_column = names.index(PARTITION)
+    kept = [i for i in range(len(columns)) if i != year_column]
+    schema = pyarrow.schema([columns[i] for i in kept] + [(field, pyarrow.string()) for field in lookups])
+
+    # One pass over the table. Rows are buffered per year and each year has
+    # its own writer, so the table is never sorted or held in memory.
+    writers = {}
+    buffers = {}
+    dropped = {}
+
+    def flush(year):
+        rows = buffers.pop(year)
+        arrays = []
+        for values, (name, type) in zip(zip(*rows), columns):
+            array, bad = typed_array(values, type)
+            if bad:
+                dropped[name] = dropped.get(name, 0) + bad
+            arrays.append(array)
+        arrays = [arrays[i] for i in kept] + [lookup(arrays[names.index(f"{field}_id")]) for field, lookup in lookups.items()]
+        if year not in writers:
+            path = partition_path(directory, year)
+            path.parent.mkdir(parents=True)
+            writers[year] = pyarrow.parquet.ParquetWriter(path, schema)
+        writers[year].write_batch(pyarrow.record_batch(arrays, schema=schema))
+
+    count = 0
+    cursor = con.execute(f"SELECT {', '.join(f'[{name}]' for name in names)} FROM [{table}]")
+    try:
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                buffer = buffers.setdefault(row[year_column], [])
+                buffer.append(row)
+                if len(buffer) >= batch_size:
+                    flush(row[year_column])
+            count += len(rows)
+        for year in list(buffers):
+            flush(year)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    for name, bad in dropped.items():
+        print(f"{table}.{name}: {bad} values that aren't {dict(columns)[name]} exported as null")
+    return count, len(writers)
+
+
+def export_tables(con, directory=DIRECTORY, tables=TABLES, skip=()):
+    directory = pathlib.Path(directory)
+    for table in tables:
+        path = directory / table
+        if table in skip and path.exists():
+            print(f"{table} is unchanged, keeping {path}")
+            continue
+        start = time.monotonic()
+        # Written next to the old copy and swapped in, so a reader never sees
+        # half a table.
+        partial = directory / f"{table}.partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        partial.mkdir(parents=True)
+        rows, partitions = export_table(con, table, partial)
+        shutil.rmtree(path, ignore_errors=True)
+        partial.rename(path)
+        print(f"Exported {rows} {table} rows in {partitions} partitions to {path} in {time.monotonic() - start:.1f}s")
+
+
+def read_table(table, columns=None, filters=None, directory=DIRECTORY):
+    # Only the requested columns and the partitions and row groups the
+    # filters can match are read, from memory mapped files. filters uses the
+    # pyarrow.parquet format, for example [("election_year", "in", [2022])].
+    path = pathlib.Path(directory) / table
+    dictionaries = [field for field in ingest.DICTIONARY_ROWS if columns is None or field in columns]
+    partitioning = pyarrow.dataset.partitioning(pyarrow.schema([(PARTITION, pyarrow.int64())]), flavor="hive")
+    return pyarrow.parquet.read_table(path, columns=columns, filters=filters, memory_map=True,
+                                      partitioning=partitioning, read_dictionary=dictionaries).to_pandas()
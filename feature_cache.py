@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+import numpy
+import pandas
+
+# On disk cache for comparison features. Features only depend on the values
+# being compared, so each candidate pair is keyed by a hash of the compared
+# columns of both records. Entries live in feather chunks under a namespace
+# for the comparison spec and index parameters; a run loads the chunks,
+# computes the pairs that are missing and appends them as a new chunk. Old
+# chunks are evicted least recently used first to stay under a disk budget.
+
+DEFAULT_DIRECTORY = pathlib.Path("build/feature_cache")
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def namespace(compare, index_params):
+    spec = {"features": [list(feature) for feature in compare.features], "index": index_params}
+    return hashlib.blake2b(json.dumps(spec, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+
+
+def record_hashes(x, columns):
+    return pandas.util.hash_pandas_object(x[sorted(set(columns))], index=False)
+
+
+def pair_keys(pairs, x, x_link, compare):
+    left = record_hashes(x, [feature[0] for feature in compare.features])
+    right = record_hashes(x_link, [feature[1] for feature in compare.features])
+    both = pandas.DataFrame({
+        "left": left.to_numpy()[x.index.get_indexer(pairs.get_level_values(0))],
+        "right": right.to_numpy()[x_link.index.get_indexer(pairs.get_level_values(1))],
+    })
+    return pandas.util.hash_pandas_object(both, index=False).to_numpy()
+
+
+class FeatureCache:
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+
+    def load(self, path, labels):
+        chunks = []
+        for chunk in sorted(path.glob("*.feather")):
+            chunks.append(pandas.read_feather(chunk, columns=["key"] + labels))
+            # The mtime is the last use for eviction.
+            os.utime(chunk)
+        if not chunks:
+            return pandas.DataFrame(columns=labels, index=pandas.Index([], dtype=numpy.uint64, name="key"))
+        cached = pandas.concat(chunks, ignore_index=True).drop_duplicates("key")
+        return cached.set_index("key")
+
+    def compute(self, compare, pairs, x, x_link=None, index_params=None):
+        if x_link is None:
+            x_link = x
+        labels = [feature[3] for feature in compare.features]
+        path = self.directory / namespace(compare, index_params)
+        path.mkdir(parents=True, exist_ok=True)
+
+        start = time.monotonic()
+        keys = pair_keys(pairs, x, x_link, compare)
+        cached = self.load(path, labels)
+        missing = ~numpy.isin(keys, cached.index.to_numpy())
+        # Identical records give identical keys, compute each one once.
+        _, first = numpy.unique(keys, return_index=True)
+        todo = numpy.zeros(len(keys), dtype=bool)
+        todo[first] = True
+        todo &= missing
+        print(f"feature cache: {len(keys) - missing.sum()} of {len(keys)} pairs cached, computing {todo.sum()} "
+              f"(loaded in {time.monotonic() - start:.1f}s)")
+
+        if todo.any():
+            computed = compare.compute(pairs[todo], x, x_link)
+            new = pandas.DataFrame(computed.to_numpy(), columns=labels)
+            new.insert(0, "key", keys[todo])
+            new.to_feather(path / f"{time.time_ns()}.feather")
+            cached = pandas.concat((cached, new.set_index("key"))) if len(cached) else new.set_index("key")
+            self.evict()
+
+        features = cached.reindex(keys)
+        features.index = pairs
+        return features
+
+    def evict(self):
+        chunks = sorted(self.directory.glob("*/*.feather"), key=lambda chunk: chunk.stat().st_mtime)
+        total = sum(chunk.stat().st_size for chunk in chunks)
+        for chunk in chunks:
+            if total <= self.max_bytes:
+                break
+            total -= chunk.stat().st_size
+            chunk.unlink()
+            print("feature cache: evicted", chunk)
@@ -0,0 +1,70 @@
+import time
+
+import ingest
+
+# Access paths used by static_build.py, match_exp_cont.py and the datasette
+# templates. Built after the bulk load so SQLite can sort each one once
+# instead of maintaining it row by row.
+INDEXES = (
+    ("contributions", ("filer_id", "receipt_date")),
+    ("contributions", ("contributor_name_id", "receipt_date")),
+    ("contributions", ("contributor_employer_name_id", "receipt_date")),
+    # Covering indexes for the per filer totals and code_id breakdowns.
+    ("contributions", ("election_year", "filer_id", "amount")),
+    ("contributions", ("filer_id", "election_year", "code_id", "amount")),
+    ("expenditures", ("filer_id", "expenditure_date")),
+    # match_exp_cont.py --stream reads both tables a date window at a time.
+    ("contributions", ("receipt_date",)),
+    ("expenditures", ("expenditure_date",)),
+    ("registrations", ("filer_id", "election_year")),
+    ("registrations", ("committee_id",)),
+    # Rollups from rollups.py.
+    ("contribution_totals", ("election_year", "total_amount")),
+    ("contribution_totals", ("contributor_name", "election_year")),
+    ("contribution_totals", ("contributor_name_id", "election_year")),
+    ("filer_totals", ("election_year", "total")),
+    ("filer_totals", ("filer_id", "election_year")),
+    ("filer_code_totals", ("filer_id", "election_year", "total")),
+    ("contributor_filer_totals", ("filer_id", "total")),
+    ("contributor_filer_totals", ("contributor_name", "total")),
+    ("contributor_filer_totals", ("contributor_name_id", "filer_id")),
+    ("contributor_year_totals", ("contributor_name", "year")),
+    ("contributor_year_totals", ("contributor_name_id",)),
+    ("employer_filer_totals", ("contributor_employer_name", "total")),
+    ("employer_filer_totals", ("contributor_employer_name_id", "filer_id")),
+    ("employer_year_totals", ("contributor_employer_name", "year")),
+    ("employer_year_totals", ("contributor_employer_name_id",)),
+    # Canonical donors from entities.py.
+    ("contribution_donors", ("donor_id",)),
+    ("donor_totals", ("election_year", "total_amount")),
+    ("donor_filer_totals", ("donor_id", "total")),
+    ("donor_filer_totals", ("filer_id", "total")),
+    ("donor_year_totals", ("donor_id", "year")),
+)
+
+
+def index_name(table, columns):
+    return f"idx_{table}_{'_'.join(columns)}"
+
+
+def build_indexes(con, tables):
+    total = time.monotonic()
+    for table, columns in INDEXES:
+        if table not in tables:
+            continue
+        if not set(columns) <= ingest.table_columns(con, table):
+            print("Skipping", index_name(table, columns))
+            continue
+        start = time.monotonic()
+        cols = ", ".join(f"[{c}]" for c in columns)
+        with con:
+            con.execute(f"CREATE INDEX IF NOT EXISTS [{index_name(table, columns)}] ON [{table}] ({cols})")
+        print(f"Built {index_name(table, columns)} in {time.monotonic() - start:.1f}s")
+    print(f"Indexing took {time.monotonic() - total:.1f}s")
+
+
+def analyze(con):
+    start = time.monotonic()
+    with con:
+        con.execute("ANALYZE")
+    print(f"ANALYZE took {time.monotonic() - start:.1f}s")
@@ -0,0 +1,418 @@
+import collections
+import csv
+import datetime
+import functools
+import hashlib
+import time
+
+import dateutil.parser
+import progressbar
+
+INT_ROWS = ("id", "report_number", "committee_zip", "party_code", "committee_id", "election_year", "recipient_zip", "treasurer_zip", "contributor_zip")
+DATE_ROWS = ("expenditure_date", "receipt_date")
+FLOAT_ROWS = ("amount",)
+EXTRACT_ROWS = ("party", "filer_type", "origin", "filer_name", "type", "cash_or_in_kind", "code", "contributor_category", "primary_general", "itemized_or_non_itemized")
+# High cardinality strings that are normalized like any other text and then
+# stored as ids into lookup tables like EXTRACT_ROWS. [{table}_named] views
+# put the strings back for datasette and the analysis scripts.
+ENCODED_ROWS = ("contributor_name", "contributor_address", "contributor_employer_name")
+DICTIONARY_ROWS = EXTRACT_ROWS + ENCODED_ROWS
+
+PRINT_BAD_VALUES = False
+
+# Rows per executemany() call and per transaction.
+BATCH_SIZE = 20000
+
+# Only used while loading. raw.db also holds entity_map, entity_map_shards
+# and matched_contributions, which can't be rebuilt from build/, so a crash
+# mustn't corrupt it. WAL with synchronous=NORMAL can lose the last
+# transactions but not the database, and skips most of the fsyncs. The
+# defaults are restored, which checkpoints the WAL, once the load is done.
+INGEST_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -512 * 1024,
+    "temp_store": "MEMORY",
+}
+DEFAULT_PRAGMAS = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+}
+
+
+def set_pragmas(con, pragmas):
+    for name, value in pragmas.items():
+        con.execute(f"PRAGMA {name}={value}")
+
+
+class DictionaryEncoder:
+    # Maps the values of one DICTIONARY_ROWS column to ids in its
+    # [{table}_{field}] lookup table. Everything already in the table is loaded
+    # up front and new ids are handed out here, so encoding never touches the
+    # database. New entries are written by flush() alongside each batch.
+    def __init__(self, con, table, field):
+        self.table = table
+        self.field = field
+        self.ids = {value: id for id, value in con.execute(f"SELECT id, [{field}] FROM [{table}_{field}]")}
+        self.next_id = max(self.ids.values(), default=0) + 1
+        self.preloaded = len(self.ids)
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, value):
+        id = self.ids.get(value)
+        if id is not None:
+            self.hits += 1
+            return id
+        self.misses += 1
+        id = self.next_id
+        self.next_id += 1
+        self.ids[value] = id
+        self.pending.append((id, value))
+        return id
+
+    def flush(self, con):
+        if self.pending:
+            con.executemany(f"INSERT INTO [{self.table}_{self.field}]([id], [{self.field}]) VALUES (?, ?)", self.pending)
+            self.pending = []
+
+    def stats(self):
+        return {"preloaded": self.preloaded, "hits": self.hits, "misses": self.misses, "size": len(self.ids)}
+
+
+# Strings parse_date() couldn't handle itself and handed to dateutil.
+DATE_FALLBACKS = collections.Counter()
+
+
+@functools.lru_cache(len(DATE_ROWS) * 256)
+def _parse_date_fallback(value):
+    d = dateutil.parser.parse(value)
+    if d is None:
+        print(value)
+    return d.date().isoformat()
+
+
+def parse_date(value):
+    # The PDC exports use MM/DD/YYYY, optionally followed by a time, and the
+    # API and Seattle use ISO dates. Slice those directly and only ask dateutil
+    # about anything else, like two digit years.
+    try:
+        if value[2:3] == "/" and value[5:6] == "/" and len(value) >= 10 and value[6:10].isdigit() and value[10:11] in ("", " "):
+            return datetime.date(int(value[6:10]), int(value[0:2]), int(value[3:5])).isoformat()
+        if value[4:5] == "-" and value[7:8] == "-" and value[0:4].isdigit() and value[10:11] in ("", "T", " "):
+            return datetime.date(int(value[0:4]), int(value[5:7]), int(value[8:10])).isoformat()
+    except ValueError:
+        pass
+    DATE_FALLBACKS[value] += 1
+    return _parse_date_fallback(value)
+
+
+def column_type(table, field):
+    if field in INT_ROWS or field in DATE_ROWS:
+        return field, "INTEGER"
+    elif field in FLOAT_ROWS:
+        return field, "REAL"
+    elif field in DICTIONARY_ROWS:
+        return f"{field}_id", f"INTEGER REFERENCES [{table}_{field}]([id])"
+    return field, "TEXT"
+
+
+def _checked(field, convert):
+    def checked(value):
+        if value == "":
+            return None
+        try:
+            return convert(value)
+        except ValueError as e:
+            if PRINT_BAD_VALUES:
+                print(field, value, e)
+            return value
+    return checked
+
+
+def _upper(value):
+    return value.upper()
+
+
+def _address(value):
+    return value.upper().replace(".", "")
+
+
+def _encoded(normalize, encoder):
+    def encoded(value):
+        return encoder(normalize(value))
+    return encoded
+
+
+def make_converter(field, encoders):
+    # Pick the conversion for a column once from its name instead of checking
+    # every cell against the *_ROWS tuples.
+    if field in INT_ROWS:
+        convert = int
+    elif field in FLOAT_ROWS:
+        convert = float
+    elif field in DATE_ROWS:
+        convert = parse_date
+    elif field in EXTRACT_ROWS:
+        convert = encoders[field]
+    elif field in ENCODED_ROWS:
+        convert = _encoded(_address if "address" in field else _upper, encoders[field])
+    elif "address" in field:
+        convert = _address
+    else:
+        convert = _upper
+    return _checked(field, convert)
+
+
+def key_column(fieldnames):
+    # Sources without a stable id are keyed by the checksum of the whole row.
+    if "id" in fieldnames:
+        return "id"
+    return "row_hash"
+
+
+def row_hash(row):
+    digest = hashlib.blake2b("\x1f".join(row).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def table_exists(con, table):
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def table_columns(con, table):
+    return {row[1] for row in con.execute(f"PRAGMA table_info([{table}])")}
+
+
+def drop_table(con, table):
+    con.execute(f"DROP VIEW IF EXISTS [{table}_named]")
+    for field in DICTIONARY_ROWS:
+        con.execute(f"DROP TABLE IF EXISTS [{table}_{field}]")
+    con.execute(f"DROP TABLE IF EXISTS [{table}]")
+
+
+def create_table(con, table, fieldnames):
+    fields = []
+    for field in fieldnames:
+        if field in DICTIONARY_ROWS:
+            con.execute(f"CREATE TABLE IF NOT EXISTS [{table}_{field}] ([id] INTEGER PRIMARY KEY, [{field}] TEXT)")
+            con.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS [idx_{table}_{field}_{field}] ON [{table}_{field}] ([{field}])")
+        col, t = column_type(table, field)
+        fields.append(f"[{col}] {t}")
+    fields = ", ".join(fields)
+    key = key_column(fieldnames)
+    con.execute(f"CREATE TABLE [{table}] ([rowid] INTEGER PRIMARY KEY, {fields}, [row_hash] INTEGER)")
+    con.execute(f"CREATE UNIQUE INDEX [idx_{table}_{key}] ON [{table}] ([{key}])")
+    create_named_view(con, table, fieldnames)
+
+
+def create_named_view(con, table, fieldnames):
+    # The table as it looked before ENCODED_ROWS, so /raw/{table}_named and
+    # ad hoc queries can keep filtering on the strings.
+    encoded = [field for field in fieldnames if field in ENCODED_ROWS]
+    if not encoded:
+        return
+    columns = ["t.[rowid] AS [rowid]"]
+    for field in fieldnames:
+        if field in encoded:
+            columns.append(f"[{table}_{field}].[{field}] AS [{field}]")
+        else:
+            columns.append(f"t.[{column_type(table, field)[0]}]")
+    joins = " ".join(f"LEFT JOIN [{table}_{field}] ON [{table}_{field}].[id] = t.[{field}_id]" for field in encoded)
+    con.execute(f"DROP VIEW IF EXISTS [{table}_named]")
+    con.execute(f"CREATE VIEW [{table}_named] AS SELECT {', '.join(columns)} FROM [{table}] t {joins}")
+
+
+def create_sources_table(con):
+    con.execute("""CREATE TABLE IF NOT EXISTS [_sources] (
+        [source] TEXT PRIMARY KEY,
+        [file_hash] TEXT,
+        [row_count] INTEGER,
+        [high_water_mark] TEXT,
+        [loaded_at] TEXT)""")
+
+
+def source_file_hash(con, table):
+    create_sources_table(con)
+    r = con.execute("SELECT file_hash FROM [_sources] WHERE source = ?", (table,)).fetchone()
+    return r[0] if r else None
+
+
+def record_source(con, table, header, digest):
+    create_sources_table(con)
+    date_cols = [field for field in header if field in DATE_ROWS]
+    high_water_mark = None
+    if date_cols:
+        high_water_mark = con.execute(f"SELECT MAX([{date_cols[0]}]) FROM [{table}]").fetchone()[0]
+    row_count = con.execute(f"SELECT COUNT(*) FROM [{table}]").fetchone()[0]
+    con.execute("INSERT OR REPLACE INTO [_sources] VALUES (?, ?, ?, ?, ?)",
+                (table, digest, row_count, high_water_mark, datetime.datetime.now().isoformat(timespec="seconds")))
+
+
+def _counted_lines(f, bar):
+    # Progress is tracked by characters read so the file only has to be read
+    # once.
+    position = 0
+    for line in f:
+        position += len(line)
+        bar.update(position)
+        yield line
+
+
+def read_rows(path):
+    with path.open(newline="") as f, \
+         progressbar.ProgressBar(max_value=path.stat().st_size, redirect_stdout=True) as bar:
+        reader = csv.reader(_counted_lines(f, bar))
+        header = next(reader)
+        yield header
+        width = len(header)
+        for row in reader:
+            if len(row) != width:
+                # Match csv.DictReader: missing cells are empty and extra
+                # cells are dropped.
+                row = (row + [""] * width)[:width]
+            yield row
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class _Tracker:
+    # Collects the values of `columns` for every row that was inserted,
+    # changed or deleted so derived tables can be refreshed for just those
+    # keys.
+    def __init__(self, con, table, key, header, columns):
+        self.con = con
+        self.table = table
+        self.key = key
+        self.columns = [c for c in columns if c in header]
+        self.positions = [header.index(c) for c in self.columns]
+        self.affected = set()
+
+    def add_new(self, rows):
+        if self.columns:
+            for row in rows:
+                self.affected.add(tuple(row[i] for i in self.positions))
+
+    def add_existing(self, keys):
+        if not self.columns:
+            return
+        cols = ", ".join(f"[{c}]" for c in self.columns)
+        for chunk in _chunks(keys):
+            params = ", ".join("?" * len(chunk))
+            self.affected.update(self.con.execute(f"SELECT {cols} FROM [{self.table}] WHERE [{self.key}] IN ({params})", chunk))
+
+
+def load_csv(con, table, path, batch_size=BATCH_SIZE, incremental=False, track=()):
+    start = time.monotonic()
+    fallbacks = DATE_FALLBACKS.total()
+    stats = {"table": table, "inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0, "affected": set()}
+    digest = file_hash(path)
+    with path.open(newline="") as f:
+        header = next(csv.reader(f))
+    cols = [column_type(table, field)[0] for field in header] + ["row_hash"]
+    if incremental and table_exists(con, table) and not set(cols) <= table_columns(con, table):
+        # Rows can't be upserted into a table from before a schema change.
+        print(f"{table} was loaded with a different schema, rebuilding it")
+        incremental = False
+        stats["rebuilt"] = True
+    if incremental and table_exists(con, table) and source_file_hash(con, table) == digest:
+        print(f"{table} is unchanged, skipping")
+        stats["skipped"] = True
+        return stats
+
+    rows = read_rows(path)
+    next(rows)
+    key = key_column(header)
+    existing = {}
+    with con:
+        if incremental and table_exists(con, table):
+            existing = dict(con.execute(f"SELECT [{key}], row_hash FROM [{table}]"))
+        else:
+            drop_table(con, table)
+            create_table(con, table, header)
+    encoders = {field: DictionaryEncoder(con, table, field) for field in header if field in DICTIONARY_ROWS}
+    converters = [make_converter(field, encoders) for field in header]
+    insert_sql = (f"INSERT INTO [{table}]({', '.join(f'[{c}]' for c in cols)}) VALUES ({', '.join('?' * len(cols))}) "
+                  f"ON CONFLICT([{key}]) DO UPDATE SET {', '.join(f'[{c}] = excluded.[{c}]' for c in cols)}")
+    key_position = cols.index(key)
+    tracker = _Tracker(con, table, key, cols, track)
+
+    def flush(batch, changed_keys):
+        tracker.add_existing(changed_keys)
+        tracker.add_new(batch)
+        with con:
+            for encoder in encoders.values():
+                encoder.flush(con)
+            con.executemany(insert_sql, batch)
+
+    # Identical rows in sources keyed by row_hash still need distinct keys.
+    occurrences = collections.Counter() if key == "row_hash" else None
+
+    batch = []
+    changed_keys = []
+    for row in rows:
+        h = row_hash(row)
+        if occurrences is not None:
+            n = occurrences[h]
+            occurrences[h] += 1
+            if n:
+                h = row_hash(row + [str(n)])
+        if key_position < len(row):
+            k = converters[key_position](row[key_position])
+        else:
+            k = h
+        if existing:
+            old = existing.pop(k, None)
+            if old == h:
+                stats["unchanged"] += 1
+                continue
+            if old is not None:
+                changed_keys.append(k)
+                stats["updated"] += 1
+            else:
+                stats["inserted"] += 1
+        else:
+            stats["inserted"] += 1
+        converted = [convert(value) for convert, value in zip(converters, row)]
+        converted.append(h)
+        batch.append(converted)
+        if len(batch) >= batch_size:
+            flush(batch, changed_keys)
+            batch = []
+            changed_keys = []
+    flush(batch, changed_keys)
+
+    # Whatever is left in existing wasn't in the new file.
+    deleted = list(existing)
+    tracker.add_existing(deleted)
+    with con:
+        for chunk in _chunks(deleted):
+            con.execute(f"DELETE FROM [{table}] WHERE [{key}] IN ({', '.join('?' * len(chunk))})", chunk)
+        record_source(con, table, header, digest)
+    stats["deleted"] = len(deleted)
+    stats["affected"] = tracker.affected
+    stats["dictionaries"] = {field: encoder.stats() for field, encoder in encoders.items()}
+    stats["date_fallbacks"] = DATE_FALLBACKS.total() - fallbacks
+
+    duration = time.monotonic() - start
+    row_count = stats["inserted"] + stats["updated"] + stats["unchanged"]
+    print(f"Loaded {row_count} rows into {table} in {duration:.1f}s ({row_count / max(duration, 1e-9):.0f} rows/sec): "
+          f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['deleted']} deleted, {stats['unchanged']} unchanged")
+    if stats["date_fallbacks"]:
+        print(f"  {stats['date_fallbacks']} dates needed dateutil, e.g. {[v for v, _ in DATE_FALLBACKS.most_common(3)]}")
+    for field, d in stats["dictionaries"].items():
+        print(f"  {table}_{field}: {d['size']} values ({d['preloaded']} preloaded), {d['hits']} hits, {d['misses']} misses")
+    return stats
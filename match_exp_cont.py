@@ -1,49 +1,234 @@
+import argparse
+import datetime
+import os
 import pandas
 import sqlite3
 import recordlinkage
 import time
 import pathlib
-con = sqlite3.connect("file:/home/tannewt/repos/campaign-funds.org/raw.db?mode=ro", uri=True)
-contributions = pandas.read_sql_query("SELECT contributions.rowid, contributions.id, origin_id, amount, contributions.receipt_date, filer_name, committee_address, contributor_name, contributor_address FROM contributions LEFT JOIN (SELECT committee_id, filer_name_id, committee_address FROM registrations GROUP BY committee_id) as registrations ON registrations.committee_id = contributions.committee_id, registrations_filer_name WHERE registrations_filer_name.id = registrations.filer_name_id AND code_id >= 4 AND code_id <= 7 AND contributions.receipt_date IS NOT NULL AND amount > 0 ORDER BY contributions.receipt_date", con, index_col="rowid")
-print(contributions)
-expenditures = pandas.read_sql_query("SELECT expenditures.rowid, expenditures.id, origin_id, amount, expenditure_date, filer_name, committee_address, recipient_name, recipient_address FROM expenditures LEFT JOIN (SELECT committee_id, filer_name_id, committee_address FROM registrations GROUP BY committee_id) as registrations ON expenditures.committee_id = registrations.committee_id, registrations_filer_name WHERE registrations_filer_name.id = registrations.filer_name_id AND amount > 0 AND recipient_address IS NOT NULL ORDER BY expenditure_date", con, index_col="rowid")
-print(expenditures)
-print("contribution count", len(contributions))
-
-indexer = recordlinkage.Index()
-indexer.sortedneighbourhood(left_on="receipt_date", right_on="expenditure_date", window=3, block_on="amount")
-potential_matches = indexer.index(contributions, expenditures)
-
-print(len(potential_matches), "potential matches")
-
-compare = recordlinkage.Compare()
-# compare.string("contributor_name", "contributor_name", method="levenshtein", label="contributor_name_lev")
-compare.string("contributor_name", "filer_name", method="jarowinkler", label="contributor_name_jw")
-compare.string("filer_name", "recipient_name", method="jarowinkler", label="recipient_name_jw")
-compare.string("contributor_address", "committee_address", method="levenshtein", label="contributor_address_lv")
-compare.string("committee_address", "recipient_address", method="levenshtein", label="recipient_address_lv")
-
-stored = pathlib.Path("match_numbers.feather")
-start = time.monotonic()
-if stored.exists():
-    print("loading cached comparison numbers")
-    features = pandas.read_feather("match_numbers.feather", columns=["rowid_1", "rowid_2", "contributor_name_jw", "recipient_name_jw", "contributor_address_lv", "recipient_address_lv"])
-    features.set_index(["rowid_1", "rowid_2"], inplace=True)
+
+import export
+import feature_cache
+import similarity
+
+# Days of contributions matched at once in --stream mode. Expenditures are
+# loaded with a margin on both sides so pairs near a window's edge still
+# find each other.
+WINDOW_DAYS = 30
+MARGIN_DAYS = 7
+MIN_SCORE = 0.2
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--db", default="/home/tannewt/repos/campaign-funds.org/raw.db")
+parser.add_argument("--stream", action="store_true", help="Match in date windows and write to matched_contributions in the database instead of a CSV")
+parser.add_argument("--window-days", type=int, default=WINDOW_DAYS)
+parser.add_argument("--margin-days", type=int, default=MARGIN_DAYS)
+parser.add_argument("--parquet", type=pathlib.Path, help="Read the tables from the files update.py --export-parquet writes, like build/parquet")
+args = parser.parse_args()
+
+CONTRIBUTIONS = "SELECT contributions.rowid, contributions.id, origin_id, amount, contributions.receipt_date, filer_name, committee_address, contributor_name, contributor_address FROM contributions_named AS contributions LEFT JOIN {committees} as registrations ON registrations.committee_id = contributions.committee_id, registrations_filer_name WHERE registrations_filer_name.id = registrations.filer_name_id AND code_id >= 4 AND code_id <= 7 AND contributions.receipt_date IS NOT NULL AND amount > 0 {where} ORDER BY contributions.receipt_date"
+EXPENDITURES = "SELECT expenditures.rowid, expenditures.id, origin_id, amount, expenditure_date, filer_name, committee_address, recipient_name, recipient_address FROM expenditures LEFT JOIN {committees} as registrations ON expenditures.committee_id = registrations.committee_id, registrations_filer_name WHERE registrations_filer_name.id = registrations.filer_name_id AND amount > 0 AND recipient_address IS NOT NULL {where} ORDER BY expenditure_date"
+COMMITTEES = "SELECT committee_id, filer_name_id, committee_address FROM registrations GROUP BY committee_id"
+# The same rows and columns from the parquet export.
+CONTRIBUTION_COLUMNS = ["rowid", "id", "origin_id", "amount", "receipt_date", "filer_name", "committee_address", "contributor_name", "contributor_address"]
+EXPENDITURE_COLUMNS = ["rowid", "id", "origin_id", "amount", "expenditure_date", "filer_name", "committee_address", "recipient_name", "recipient_address"]
+# Raw dates ingest.py couldn't parse, like "13/45/2021", are kept as they
+# were. Only values shaped like ISO dates can bound the windows.
+ISO_DATE_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*"
+ISO_DATE_PATTERN = r"\d{4}-\d\d-\d\d"
+INDEX_PARAMS = {"sortedneighbourhood": ["receipt_date", "expenditure_date"], "window": 3, "block_on": "amount"}
+
+
+def candidate_pairs(contributions, expenditures):
+    indexer = recordlinkage.Index()
+    indexer.sortedneighbourhood(left_on="receipt_date", right_on="expenditure_date", window=3, block_on="amount")
+    return indexer.index(contributions, expenditures)
+
+
+def comparer(jobs):
+    compare = similarity.Compare(jobs=jobs)
+    # compare.string("contributor_name", "contributor_name", method="levenshtein", label="contributor_name_lev")
+    compare.string("contributor_name", "filer_name", method="jarowinkler", label="contributor_name_jw")
+    compare.string("filer_name", "recipient_name", method="jarowinkler", label="recipient_name_jw")
+    compare.string("contributor_address", "committee_address", method="levenshtein", label="contributor_address_lv")
+    compare.string("committee_address", "recipient_address", method="levenshtein", label="recipient_address_lv")
+    return compare
+
+
+def score(features):
+    return features["contributor_name_jw"] * features["recipient_name_jw"] * features["recipient_address_lv"] * features["contributor_address_lv"]
+
+
+def create_matches_table(con):
+    with con:
+        con.execute("DROP TABLE IF EXISTS matched_contributions")
+        # Keyed by the PDC ids, which survive update.py rebuilding the tables
+        # with new rowids.
+        con.execute("""CREATE TABLE matched_contributions (
+            contribution_id INTEGER PRIMARY KEY,
+            expenditure_id INTEGER,
+            score REAL,
+            contributor_name_jw REAL,
+            recipient_name_jw REAL,
+            contributor_address_lv REAL,
+            recipient_address_lv REAL
+        )""")
+        con.execute("CREATE INDEX idx_matched_contributions_expenditure_id ON matched_contributions (expenditure_id)")
+
+
+class SQLTables:
+    def __init__(self, con, committees):
+        self.con = con
+        self.committees = committees
+
+    def receipt_dates(self):
+        return self.con.execute("SELECT MIN(receipt_date), MAX(receipt_date) FROM contributions WHERE code_id >= 4 AND code_id <= 7 AND amount > 0 AND receipt_date GLOB ?", (ISO_DATE_GLOB,)).fetchone()
+
+    def contributions(self, start=None, end=None):
+        if start is None:
+            return pandas.read_sql_query(CONTRIBUTIONS.format(committees=self.committees, where=""), self.con, index_col="rowid")
+        return pandas.read_sql_query(
+            CONTRIBUTIONS.format(committees=self.committees, where="AND contributions.receipt_date >= ? AND contributions.receipt_date < ?"),
+            self.con, index_col="rowid", params=(start, end))
+
+    def expenditures(self, start=None, end=None):
+        if start is None:
+            return pandas.read_sql_query(EXPENDITURES.format(committees=self.committees, where=""), self.con, index_col="rowid")
+        return pandas.read_sql_query(
+            EXPENDITURES.format(committees=self.committees, where="AND expenditure_date >= ? AND expenditure_date < ?"),
+            self.con, index_col="rowid", params=(start, end))
+
+
+class ParquetTables:
+    # Loads just the columns and rows matching needs once, memory mapped,
+    # and slices date windows out of them.
+    def __init__(self, directory):
+        committees = export.read_table("registrations", ["committee_id", "filer_name", "committee_address"], directory=directory)
+        committees = committees.drop_duplicates("committee_id", keep="last")
+        contributions = export.read_table(
+            "contributions", ["rowid", "id", "origin_id", "amount", "receipt_date", "committee_id", "contributor_name", "contributor_address"],
+            filters=[("code_id", ">=", 4), ("code_id", "<=", 7), ("amount", ">", 0)], directory=directory)
+        expenditures = export.read_table(
+            "expenditures", ["rowid", "id", "origin_id", "amount", "expenditure_date", "committee_id", "recipient_name", "recipient_address"],
+            filters=[("amount", ">", 0)], directory=directory)
+        self.contribution_rows = self.prepare(contributions.dropna(subset=["receipt_date"]), committees, "receipt_date", CONTRIBUTION_COLUMNS)
+        self.expenditure_rows = self.prepare(expenditures.dropna(subset=["recipient_address"]), committees, "expenditure_date", EXPENDITURE_COLUMNS)
+
+    def prepare(self, rows, committees, date, columns):
+        rows = rows.merge(committees, on="committee_id").sort_values("rowid").sort_values(date, kind="stable")
+        return rows[columns].set_index("rowid")
+
+    def receipt_dates(self):
+        dates = self.contribution_rows["receipt_date"]
+        dates = dates[dates.str.match(ISO_DATE_PATTERN)]
+        if dates.empty:
+            return None, None
+        return dates.iloc[0], dates.iloc[-1]
+
+    def window(self, rows, date, start, end):
+        if start is None:
+            return rows
+        dates = rows[date].to_numpy()
+        return rows.iloc[dates.searchsorted(start):dates.searchsorted(end)]
+
+    def contributions(self, start=None, end=None):
+        return self.window(self.contribution_rows, "receipt_date", start, end)
+
+    def expenditures(self, start=None, end=None):
+        return self.window(self.expenditure_rows, "expenditure_date", start, end)
+
+
+def windows(tables, days):
+    first, last = tables.receipt_dates()
+    if first is None:
+        return
+    try:
+        start = datetime.date.fromisoformat(first[:10])
+        last = datetime.date.fromisoformat(last[:10])
+    except ValueError as e:
+        raise ValueError(f"receipt_date {first!r} to {last!r} can't bound the windows: {e}") from e
+    while start <= last:
+        end = start + datetime.timedelta(days=days)
+        yield start, end
+        start = end
+
+
+def stream_matches(con, tables, compare):
+    # Only one window of each table and its features are ever in memory.
+    create_matches_table(con)
+    margin = datetime.timedelta(days=args.margin_days)
+    totals = {"contributions": 0, "pairs": 0, "matches": 0}
+    start = time.monotonic()
+    for window_start, window_end in windows(tables, args.window_days):
+        window_timer = time.monotonic()
+        contributions = tables.contributions(window_start.isoformat(), window_end.isoformat())
+        if contributions.empty:
+            continue
+        expenditures = tables.expenditures((window_start - margin).isoformat(), (window_end + margin).isoformat())
+        pairs = candidate_pairs(contributions, expenditures) if not expenditures.empty else []
+        matches = 0
+        if len(pairs):
+            features = compare.compute(pairs, contributions, expenditures)
+            features["score"] = score(features)
+            features = features[features["score"] > MIN_SCORE]
+            # Best expenditure for each contribution in the window.
+            best = features.loc[features.groupby(level=0)["score"].idxmax()]
+            contribution_ids = contributions["id"].loc[best.index.get_level_values(0)]
+            expenditure_ids = expenditures["id"].loc[best.index.get_level_values(1)]
+            with con:
+                con.executemany("INSERT OR REPLACE INTO matched_contributions VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                    (int(a), int(b), row.score, row.contributor_name_jw, row.recipient_name_jw, row.contributor_address_lv, row.recipient_address_lv)
+                    for a, b, row in zip(contribution_ids, expenditure_ids, best.itertuples(index=False))))
+            matches = len(best)
+        totals["contributions"] += len(contributions)
+        totals["pairs"] += len(pairs)
+        totals["matches"] += matches
+        print(f"{window_start} - {window_end}: {len(contributions)} contributions, {len(expenditures)} expenditures, "
+              f"{len(pairs)} pairs, {matches} matches in {time.monotonic() - window_timer:.1f}s")
+    print(f"Matched {totals['matches']} of {totals['contributions']} contributions from {totals['pairs']} pairs in {time.monotonic() - start:.1f}s")
+
+
+if args.stream:
+    con = sqlite3.connect(args.db)
+    if args.parquet:
+        tables = ParquetTables(args.parquet)
+    else:
+        con.execute(f"CREATE TEMP TABLE committees AS {COMMITTEES}")
+        con.execute("CREATE INDEX temp.idx_committees_committee_id ON committees (committee_id)")
+        tables = SQLTables(con, "temp.committees")
+    stream_matches(con, tables, comparer(os.cpu_count()))
+    con.close()
 else:
-    print("comparing")
-    features = compare.compute(potential_matches, contributions, expenditures)
-    features.reset_index().to_feather("match_numbers.feather")
-duration = time.monotonic() - start
-print("done in", duration)
-
-features = features.join(contributions, on=("rowid_1"), how="inner").join(expenditures, on=("rowid_2"), how="inner", lsuffix="_cont", rsuffix="_exp")
-features["score"] = features["contributor_name_jw"] * features["recipient_name_jw"] * features["recipient_address_lv"] * features["contributor_address_lv"]
-features = features[features["score"] > 0.2]
-# features.sort_values("score", inplace=True)
-features.sort_index(level=0, inplace=True)
-maxes = features.groupby(level=0)["score"].transform(max) == features["score"]
-features[maxes].to_csv("matched_contributions.csv")
-print(features[maxes])
+    if args.parquet:
+        tables = ParquetTables(args.parquet)
+    else:
+        con = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+        tables = SQLTables(con, f"({COMMITTEES})")
+    contributions = tables.contributions()
+    print(contributions)
+    expenditures = tables.expenditures()
+    print(expenditures)
+    print("contribution count", len(contributions))
+
+    potential_matches = candidate_pairs(contributions, expenditures)
+
+    print(len(potential_matches), "potential matches")
+
+    compare = comparer(os.cpu_count())
+
+    start = time.monotonic()
+    features = feature_cache.FeatureCache().compute(compare, potential_matches, contributions, expenditures, index_params=INDEX_PARAMS)
+    duration = time.monotonic() - start
+    print("done in", duration)
+
+    features = features.join(contributions, on=("rowid_1"), how="inner").join(expenditures, on=("rowid_2"), how="inner", lsuffix="_cont", rsuffix="_exp")
+    features["score"] = score(features)
+    features = features[features["score"] > MIN_SCORE]
+    # features.sort_values("score", inplace=True)
+    features.sort_index(level=0, inplace=True)
+    maxes = features.groupby(level=0)["score"].transform(max) == features["score"]
+    features[maxes].to_csv("matched_contributions.csv")
+    print(features[maxes])
 
 # # for unmatched in set(df.index) - matched:
 # #     print(unmatched)
@@ -1,14 +1,48 @@
 from datasette import hookimpl
 import markupsafe
 import json
+import urllib.parse
 
 COLUMNS = {
     "filer_id": "/filer/{}",
-    "contributor_name": "/donor/{}"
+    "contributor_name": "/donor/{}",
+    "contributor_employer_name": "/employer/{}",
 }
 
+# Columns ingest.py stores as ids into a [{table}_{field}] lookup table, by
+# the lookup table and the name column they link as.
+ID_COLUMNS = {
+    "contributor_name_id": ("contributions_contributor_name", "contributor_name"),
+    "contributor_employer_name_id": ("contributions_contributor_employer_name", "contributor_employer_name"),
+}
+
+
+def link(column, label):
+    return markupsafe.Markup('<a href="{href}">{label}</a>'.format(
+        href=markupsafe.escape(COLUMNS[column].format(urllib.parse.quote(str(label), safe=""))),
+        label=markupsafe.escape(label)
+    ))
+
+
+async def link_id(value, column, database, datasette):
+    lookup, name = ID_COLUMNS[column]
+    # Tables with a foreign key to the lookup table arrive with the label
+    # already expanded, the rollup tables only have the id.
+    if isinstance(value, dict):
+        label = value["label"]
+    elif value is not None:
+        row = (await datasette.get_database(database).execute(
+            f"select [{name}] from [{lookup}] where id = ?", [value])).first()
+        label = row[0] if row else None
+    else:
+        label = None
+    return link(name, label) if label else None
+
+
 @hookimpl
 def render_cell(value, column, table, database, datasette):
+    if column in ID_COLUMNS:
+        return link_id(value, column, database, datasette)
     # Render {"href": "...", "label": "..."} as link
     if column not in COLUMNS:
         return None
@@ -0,0 +1,143 @@
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+from functools import wraps
+import collections
+import hashlib
+import pathlib
+
+# Pages only change when update.py rewrites raw.db so whole responses are
+# cached until the file's mtime or size changes.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Table views, JSON, datasette internals and static files aren't pages.
+SKIP_PREFIXES = ("/raw", "/db", "/-/", "/static")
+
+
+class PageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        size = len(entry["body"])
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key)["body"])
+        self.entries[key] = entry
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted["body"])
+            self.evictions += 1
+
+
+def database_version(datasette):
+    db = datasette.get_database("raw")
+    stat = pathlib.Path(db.path).stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+
+async def send_entry(send, entry, if_none_match, cache_status):
+    headers = entry["headers"] + [[b"x-page-cache", cache_status]]
+    if entry["status"] == 200 and if_none_match == entry["etag"]:
+        headers = [[k, v] for k, v in headers if k.lower() != b"content-length"]
+        await send({"type": "http.response.start", "status": 304, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send({"type": "http.response.start", "status": entry["status"], "headers": headers})
+    await send({"type": "http.response.body", "body": entry["body"]})
+
+
+cache = PageCache(DEFAULT_MAX_BYTES)
+
+
+@hookimpl
+def asgi_wrapper(datasette):
+    config = datasette.plugin_config("page_cache") or {}
+    cache.max_bytes = config.get("max_bytes", DEFAULT_MAX_BYTES)
+
+    def wrap_with_page_cache(app):
+        @wraps(app)
+        async def page_cache(scope, receive, send):
+            if (scope["type"] != "http" or scope["method"] not in ("GET", "HEAD")
+                    or scope["path"].startswith(SKIP_PREFIXES)):
+                await app(scope, receive, send)
+                return
+
+            cache.check_version(database_version(datasette))
+            key = (scope["method"], scope["path"], scope.get("query_string", b""))
+            if_none_match = header(scope, b"if-none-match")
+            entry = cache.get(key)
+            if entry is not None:
+                await send_entry(send, entry, if_none_match, b"hit")
+                return
+
+            response = {"headers": [], "body": []}
+
+            async def capture(message):
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    response["headers"] = [list(h) for h in message.get("headers", [])]
+                elif message["type"] == "http.response.body":
+                    response["body"].append(message.get("body", b""))
+
+            await app(scope, receive, capture)
+
+            body = b"".join(response["body"])
+            etag = b'"' + hashlib.sha256(body).hexdigest()[:20].encode() + b'"'
+            entry = {
+                "status": response["status"],
+                "headers": response["headers"] + [[b"etag", etag]],
+                "body": body,
+                "etag": etag,
+            }
+            cacheable = response["status"] == 200 and not any(k.lower() == b"set-cookie" for k, _ in response["headers"])
+            if cacheable:
+                cache.put(key, entry)
+            await send_entry(send, entry, if_none_match, b"miss")
+        return page_cache
+    return wrap_with_page_cache
+
+
+@hookimpl
+def register_routes():
+    return [(r"^/-/page-cache\.json$", page_cache_stats)]
+
+
+async def page_cache_stats():
+    return Response.json({
+        "entries": len(cache.entries),
+        "bytes": cache.size,
+        "max_bytes": cache.max_bytes,
+        "hits": cache.hits,
+        "misses": cache.misses,
+        "evictions": cache.evictions,
+    })
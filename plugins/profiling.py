@@ -0,0 +1,312 @@
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+from functools import lru_cache, wraps
+import bisect
+import collections
+import contextvars
+import hashlib
+import pathlib
+import re
+import time
+
+# Times every query datasette runs, including the sql() calls in templates,
+# and every page request, so a slow page can be traced to the query behind
+# it. Queries are grouped by fingerprint, the SQL with its literals taken
+# out. The first time a fingerprint runs against a raw.db version its
+# EXPLAIN QUERY PLAN is checked for full table scans and temp b-trees.
+# Whatever a request spent outside queries is counted as render time.
+DEFAULT_SLOW_MS = 100
+DEFAULT_SLOW_LOG_SIZE = 200
+# Histogram bucket upper bounds in milliseconds, the last catches the rest.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+TOP_QUERIES = 50
+# Paths and SQL come from clients, so both tables are capped. The least
+# recently run queries are dropped first, and routes past the limit, like
+# 404s, are counted under OTHER.
+DEFAULT_MAX_QUERIES = 1000
+MAX_ROUTES = 100
+OTHER = "other"
+MAX_PARAMS_LENGTH = 500
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+# The pages static_build.py also writes, by the kind of page.
+ROUTES = ("/donor/", "/employer/", "/filer/", "/election/")
+
+current = contextvars.ContextVar("profiling_request", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.buckets[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else None,
+            "max_ms": round(self.max, 3),
+            "buckets": {f"<={bound}" if i < len(BUCKETS) else f">{BUCKETS[-1]}": n
+                        for i, (bound, n) in enumerate(zip(BUCKETS + (None,), self.buckets)) if n},
+        }
+
+
+class RouteStats:
+    def __init__(self):
+        self.request = Histogram()
+        self.sql = Histogram()
+        self.render = Histogram()
+        self.queries = 0
+        self.page_cache_hits = 0
+        self.statuses = collections.Counter()
+
+    def stats(self):
+        return {
+            "request": self.request.stats(),
+            "sql": self.sql.stats(),
+            "render": self.render.stats(),
+            "queries": self.queries,
+            "page_cache_hits": self.page_cache_hits,
+            "statuses": dict(self.statuses),
+        }
+
+
+class QueryStats:
+    def __init__(self, sql):
+        self.sql = sql
+        self.time = Histogram()
+        self.rows = 0
+        self.routes = collections.Counter()
+        self.plan = None
+        # raw.db version the plan was checked on.
+        self.planned = False
+
+    def stats(self, key):
+        database, fingerprint = key
+        return {
+            "database": database,
+            "fingerprint": fingerprint,
+            "sql": self.sql,
+            "rows": self.rows,
+            "routes": dict(self.routes.most_common(10)),
+            "plan": self.plan,
+            **self.time.stats(),
+        }
+
+
+class Profile:
+    def __init__(self, slow_ms, slow_log_size, max_queries):
+        self.slow_ms = slow_ms
+        self.max_queries = max_queries
+        self.routes = {}
+        # (database, fingerprint) -> QueryStats, least recently run first.
+        self.queries = collections.OrderedDict()
+        self.slow = collections.deque(maxlen=slow_log_size)
+        self.evicted = 0
+        self.started = time.time()
+
+    def query(self, key, shape):
+        stats = self.queries.get(key)
+        if stats is None:
+            stats = self.queries[key] = QueryStats(shape)
+            if len(self.queries) > self.max_queries:
+                self.queries.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.queries.move_to_end(key)
+        return stats
+
+    def route(self, name, status):
+        if status == 404 or (name not in self.routes and len(self.routes) >= MAX_ROUTES):
+            name = OTHER
+        stats = self.routes.get(name)
+        if stats is None:
+            stats = self.routes[name] = RouteStats()
+        return stats
+
+    def stats(self):
+        queries = sorted(self.queries.items(), key=lambda item: item[1].time.total, reverse=True)
+        return {
+            "started": self.started,
+            "slow_ms": self.slow_ms,
+            "evicted_queries": self.evicted,
+            "routes": {route: stats.stats() for route, stats in sorted(self.routes.items())},
+            "queries": [stats.stats(key) for key, stats in queries[:TOP_QUERIES]],
+            "full_scans": [stats.stats(key) for key, stats in queries
+                           if stats.plan and (stats.plan["scans"] or stats.plan["temp_b_tree"])][:TOP_QUERIES],
+            "slow": list(reversed(self.slow)),
+        }
+
+
+profile = Profile(DEFAULT_SLOW_MS, DEFAULT_SLOW_LOG_SIZE, DEFAULT_MAX_QUERIES)
+enabled = True
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    sql = " ".join(sql.split())
+    shape = IN_LIST.sub("IN (?)", NUMBER.sub("?", STRING.sub("?", sql)))
+    return hashlib.blake2b(shape.encode(), digest_size=8).hexdigest(), shape
+
+
+def route(path):
+    for prefix in ROUTES:
+        if path.startswith(prefix):
+            return prefix + "*"
+    if path.startswith("/-/"):
+        return path
+    parts = path.split("/")
+    # /raw/contributions_named.json and /raw/contributions_named are the
+    # same table view.
+    if len(parts) > 2:
+        return "/".join(parts[:3]).split(".")[0] + ("/*" if len(parts) > 3 else "")
+    return path
+
+
+def database_version(db):
+    if db.path is None:
+        return None
+    stat = pathlib.Path(db.path).stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def format_params(params):
+    if not params:
+        return None
+    text = repr(params)
+    return text if len(text) <= MAX_PARAMS_LENGTH else text[:MAX_PARAMS_LENGTH] + "..."
+
+
+async def query_plan(execute, sql, params):
+    try:
+        results = await execute(f"EXPLAIN QUERY PLAN {sql}", params, log_sql_errors=False)
+    except Exception:
+        return None
+    return plan_summary([row["detail"] for row in results.rows])
+
+
+# static_build.py --profile checks its queries with this too.
+def plan_summary(details):
+    return {
+        # Index lookups read "SEARCH" and whole table reads "SCAN". Scans of
+        # covering indexes and of already materialized subqueries are fine.
+        "scans": [d for d in details if d.startswith("SCAN") and "COVERING INDEX" not in d and "subquery" not in d.lower()],
+        "temp_b_tree": any("TEMP B-TREE" in d for d in details),
+        "detail": details,
+    }
+
+
+def profile_database(db):
+    execute = db.execute
+
+    @wraps(execute)
+    async def profiled_execute(sql, params=None, *args, **kwargs):
+        if not enabled:
+            return await execute(sql, params, *args, **kwargs)
+        start = time.perf_counter()
+        results = await execute(sql, params, *args, **kwargs)
+        ms = (time.perf_counter() - start) * 1000
+        request = current.get()
+        key, shape = fingerprint(sql)
+        stats = profile.query((db.name, key), shape)
+        rows = len(results.rows)
+        stats.time.add(ms)
+        stats.rows += rows
+        if request is not None:
+            request["sql_ms"] += ms
+            request["queries"] += 1
+            stats.routes[request["route"] if len(stats.routes) < MAX_ROUTES or request["route"] in stats.routes else OTHER] += 1
+        version = database_version(db)
+        if stats.planned != version and shape.split(" ", 1)[0].upper() in ("SELECT", "WITH"):
+            stats.planned = version
+            start = time.perf_counter()
+            stats.plan = await query_plan(execute, sql, params)
+            if request is not None:
+                request["sql_ms"] += (time.perf_counter() - start) * 1000
+        if ms >= profile.slow_ms:
+            profile.slow.append({
+                "time": time.time(),
+                "ms": round(ms, 3),
+                "database": db.name,
+                "route": request["route"] if request else None,
+                "path": request["path"] if request else None,
+                "fingerprint": key,
+                "sql": " ".join(sql.split()),
+                "params": format_params(params),
+                "rows": rows,
+                "plan": stats.plan,
+            })
+        return results
+
+    db.execute = profiled_execute
+
+
+@hookimpl
+def startup(datasette):
+    global profile, enabled
+    config = datasette.plugin_config("profiling") or {}
+    enabled = config.get("enabled", True)
+    profile = Profile(config.get("slow_ms", DEFAULT_SLOW_MS), config.get("slow_log_size", DEFAULT_SLOW_LOG_SIZE),
+                      config.get("max_queries", DEFAULT_MAX_QUERIES))
+    # datasette's own _internal database isn't interesting.
+    for name, db in datasette.databases.items():
+        if not name.startswith("_"):
+            profile_database(db)
+
+
+# trylast puts this outside the other wrappers, so page_cache hits are
+# timed too.
+@hookimpl(trylast=True)
+def asgi_wrapper(datasette):
+    def wrap_with_profiling(app):
+        @wraps(app)
+        async def profiling(scope, receive, send):
+            if not enabled or scope["type"] != "http" or scope["path"].startswith("/-/profiling"):
+                await app(scope, receive, send)
+                return
+
+            request = {"route": route(scope["path"]), "path": scope["path"], "sql_ms": 0.0, "queries": 0, "status": None, "cached": False}
+            token = current.set(request)
+
+            async def capture(message):
+                if message["type"] == "http.response.start":
+                    request["status"] = message["status"]
+                    request["cached"] = [b"x-page-cache", b"hit"] in [list(h) for h in message.get("headers", [])]
+                await send(message)
+
+            start = time.perf_counter()
+            try:
+                await app(scope, receive, capture)
+            finally:
+                current.reset(token)
+                ms = (time.perf_counter() - start) * 1000
+                stats = profile.route(request["route"], request["status"])
+                stats.request.add(ms)
+                stats.queries += request["queries"]
+                stats.statuses[request["status"]] += 1
+                stats.page_cache_hits += request["cached"]
+                if request["queries"]:
+                    stats.sql.add(request["sql_ms"])
+                # Templates, page_cache and everything else but the queries.
+                stats.render.add(max(ms - request["sql_ms"], 0.0))
+        return profiling
+    return wrap_with_profiling
+
+
+@hookimpl
+def register_routes():
+    return [(r"^/-/profiling\.json$", profiling_stats)]
+
+
+async def profiling_stats():
+    return Response.json(profile.stats())
@@ -0,0 +1,151 @@
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+import asyncio
+import collections
+import pathlib
+import time
+
+# Memoizes the sql() function templates use (from datasette-template-sql) so
+# queries shared between pages, like the contribution_totals top 20 on the
+# index and robots.txt, only run once per raw.db version.
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 60 * 60
+
+
+class QueryCache:
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.inflight = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        rows, size, expires = entry
+        if expires < time.monotonic():
+            self.remove(key)
+            self.expirations += 1
+            return None
+        self.entries.move_to_end(key)
+        return rows
+
+    def remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def put(self, key, rows):
+        # Rough, but proportional to what the rows hold.
+        size = len(repr([tuple(row) for row in rows]))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = (rows, size, time.monotonic() + self.ttl)
+        self.size += size
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+cache = QueryCache(DEFAULT_MAX_BYTES, DEFAULT_TTL)
+
+
+def database_version(db):
+    if db.path is None:
+        return None
+    stat = pathlib.Path(db.path).stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def normalize(sql):
+    return " ".join(sql.split())
+
+
+def params_key(args):
+    if args is None:
+        return ()
+    if isinstance(args, dict):
+        return tuple(sorted(args.items()))
+    return tuple(args)
+
+
+@hookimpl
+def startup(datasette):
+    config = datasette.plugin_config("sql_cache") or {}
+    cache.max_bytes = config.get("max_bytes", DEFAULT_MAX_BYTES)
+    cache.ttl = config.get("ttl", DEFAULT_TTL)
+
+
+# trylast so this sql() replaces the uncached one from datasette-template-sql.
+@hookimpl(trylast=True)
+def extra_template_vars(datasette):
+    async def execute_sql(sql, args=None, database=None):
+        db = datasette.get_database(database)
+        key = (db.name, normalize(sql), params_key(args), database_version(db))
+        rows = cache.get(key)
+        if rows is not None:
+            cache.hits += 1
+            return rows
+        # Concurrent renders of the same query wait for the first one.
+        if key in cache.inflight:
+            cache.coalesced += 1
+            inflight = cache.inflight[key]
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+            # The first caller was cancelled, run the query for this one.
+            return await execute_sql(sql, args, database)
+        cache.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        cache.inflight[key] = future
+        try:
+            rows = (await db.execute(sql, args)).rows
+        except asyncio.CancelledError:
+            # The first caller went away, for example the client
+            # disconnected. The waiters mustn't hang on its future.
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved in case nobody was waiting.
+            future.exception()
+            raise
+        finally:
+            del cache.inflight[key]
+        future.set_result(rows)
+        cache.put(key, rows)
+        return rows
+
+    return {"sql": execute_sql}
+
+
+@hookimpl
+def register_routes():
+    return [(r"^/-/sql-cache\.json$", sql_cache_stats)]
+
+
+async def sql_cache_stats():
+    return Response.json(cache.stats())
@@ -0,0 +1,88 @@
+import time
+
+import ingest
+
+
+def named(select, *fields):
+    # Group by the integer ids and only join the strings from
+    # ingest.ENCODED_ROWS onto the grouped rows.
+    names = ", ".join(f"[contributions_{field}].[{field}]" for field in fields)
+    joins = " ".join(f"LEFT JOIN [contributions_{field}] ON [contributions_{field}].[id] = t.[{field}_id]" for field in fields)
+    return f"SELECT {names}, t.* FROM ({select}) t {joins}"
+
+
+# Aggregates the site serves, materialized so pages never have to scan
+# contributions. "key" is the set of contributions columns a rollup row
+# depends on; an incremental refresh recomputes just the keys that changed.
+ROLLUPS = {
+    "contribution_totals": {
+        "key": ("contributor_name_id", "election_year"),
+        "select": named("SELECT contributor_name_id, MAX(code_id) AS code_id, election_year, SUM(amount) AS total_amount FROM contributions {where} GROUP BY contributor_name_id, election_year", "contributor_name"),
+    },
+    "filer_totals": {
+        "key": ("filer_id", "election_year"),
+        "select": "SELECT filer_id, election_year, MAX(type_id) AS type_id, MAX(filer_name_id) AS filer_name_id, SUM(amount) AS total, COUNT(DISTINCT contributor_name_id) AS contributor_count FROM contributions {where} GROUP BY filer_id, election_year",
+    },
+    "filer_code_totals": {
+        "key": ("filer_id", "election_year"),
+        "select": "SELECT filer_id, election_year, code_id, SUM(amount) AS total FROM contributions {where} GROUP BY filer_id, election_year, code_id",
+    },
+    "contributor_filer_totals": {
+        "key": ("contributor_name_id", "filer_id"),
+        "select": named("SELECT contributor_name_id, filer_id, MAX(code_id) AS code_id, MAX(type_id) AS type_id, MAX(filer_name_id) AS filer_name_id, SUM(amount) AS total FROM contributions {where} GROUP BY contributor_name_id, filer_id", "contributor_name"),
+    },
+    "contributor_year_totals": {
+        "key": ("contributor_name_id",),
+        "select": named("SELECT contributor_name_id, strftime('%Y', receipt_date) AS year, SUM(amount) AS total FROM contributions {where} GROUP BY contributor_name_id, year", "contributor_name"),
+    },
+    "employer_filer_totals": {
+        "key": ("contributor_employer_name_id", "filer_id"),
+        "select": named("SELECT contributor_employer_name_id, filer_id, MAX(type_id) AS type_id, MAX(filer_name_id) AS filer_name_id, SUM(amount) AS total FROM contributions {where} GROUP BY contributor_employer_name_id, filer_id", "contributor_employer_name"),
+    },
+    "employer_year_totals": {
+        "key": ("contributor_employer_name_id",),
+        "select": named("SELECT contributor_employer_name_id, strftime('%Y', receipt_date) AS year, SUM(amount) AS total FROM contributions {where} GROUP BY contributor_employer_name_id, year", "contributor_employer_name"),
+    },
+}
+
+# Every contributions column some rollup is keyed on. update.py asks
+# ingest.load_csv() to track these for changed rows.
+KEY_COLUMNS = tuple(sorted({column for rollup in ROLLUPS.values() for column in rollup["key"]}))
+
+
+def can_refresh(con):
+    # Rollups from before a schema change have to be rebuilt.
+    return all(ingest.table_exists(con, name) and set(rollup["key"]) <= ingest.table_columns(con, name)
+               for name, rollup in ROLLUPS.items())
+
+
+def build_rollups(con):
+    for name, rollup in ROLLUPS.items():
+        start = time.monotonic()
+        with con:
+            con.execute(f"DROP TABLE IF EXISTS [{name}]")
+            con.execute(f"CREATE TABLE [{name}] AS {rollup['select'].format(where='')}")
+        print(f"Built {name} in {time.monotonic() - start:.1f}s")
+
+
+def refresh_rollups(con, affected):
+    # affected holds KEY_COLUMNS tuples for every contribution that was
+    # added, changed or removed.
+    for name, rollup in ROLLUPS.items():
+        start = time.monotonic()
+        key = rollup["key"]
+        positions = [KEY_COLUMNS.index(column) for column in key]
+        keys = {tuple(row[i] for i in positions) for row in affected}
+        # CROSS JOIN keeps temp.affected as the outer loop so both statements
+        # are index lookups rather than scans. IS rather than = so NULL names
+        # and years are refreshed too.
+        match = " AND ".join(f"t.[{column}] IS a.[{column}]" for column in key)
+        affected_rows = "SELECT t.rowid FROM temp.affected a CROSS JOIN [{0}] t ON " + match
+        with con:
+            con.execute(f"CREATE TEMP TABLE affected ({', '.join(f'[{column}]' for column in key)})")
+            con.executemany(f"INSERT INTO temp.affected VALUES ({', '.join('?' * len(key))})", keys)
+            con.execute(f"DELETE FROM [{name}] WHERE rowid IN ({affected_rows.format(name)})")
+            where = f"WHERE rowid IN ({affected_rows.format('contributions')})"
+            con.execute(f"INSERT INTO [{name}] {rollup['select'].format(where=where)}")
+            con.execute("DROP TABLE temp.affected")
+        print(f"Refreshed {len(keys)} keys of {name} in {time.monotonic() - start:.1f}s")
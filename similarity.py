@@ -0,0 +1,101 @@
+import multiprocessing
+
+import jellyfish
+import numpy
+import pandas
+
+# Drop in replacement for the string parts of recordlinkage.Compare. The same
+# names and addresses show up in thousands of candidate pairs, so each
+# feature is only computed once per distinct pair of values and the distinct
+# pairs are split into chunks across worker processes.
+
+CHUNK_SIZE = 50000
+
+
+def jarowinkler(a, b):
+    return jellyfish.jaro_winkler_similarity(a, b)
+
+
+def levenshtein(a, b):
+    longest = max(len(a), len(b))
+    # recordlinkage divides by zero here, which ends up as a missing value.
+    if longest == 0:
+        return numpy.nan
+    return 1 - jellyfish.levenshtein_distance(a, b) / longest
+
+
+METHODS = {
+    "jarowinkler": jarowinkler,
+    "jaro_winkler": jarowinkler,
+    "jw": jarowinkler,
+    "levenshtein": levenshtein,
+}
+
+
+def score_chunk(task):
+    method, left, right = task
+    similarity = METHODS[method]
+    return [similarity(a, b) for a, b in zip(left, right)]
+
+
+def pair_values(pairs, x, x_link, left_on, right_on):
+    left = x[left_on].to_numpy()[x.index.get_indexer(pairs.get_level_values(0))]
+    right = x_link[right_on].to_numpy()[x_link.index.get_indexer(pairs.get_level_values(1))]
+    return left, right
+
+
+def score(method, left, right, missing_value=0.0, chunk_size=CHUNK_SIZE, pool=None):
+    # Factorize both sides together so equal strings share a code, then
+    # only score each distinct (left, right) code pair.
+    codes, uniques = pandas.factorize(numpy.concatenate((left, right)))
+    left_codes = codes[:len(left)]
+    right_codes = codes[len(left):]
+    present = (left_codes >= 0) & (right_codes >= 0)
+    keys = left_codes[present].astype(numpy.int64) * len(uniques) + right_codes[present]
+    distinct, inverse = numpy.unique(keys, return_inverse=True)
+    values = numpy.asarray(uniques, dtype=object)
+    distinct_left = values[distinct // len(uniques)]
+    distinct_right = values[distinct % len(uniques)]
+
+    tasks = [(method, distinct_left[i:i + chunk_size], distinct_right[i:i + chunk_size])
+             for i in range(0, len(distinct), chunk_size)]
+    if pool is not None and len(tasks) > 1:
+        results = pool.map(score_chunk, tasks)
+    else:
+        results = map(score_chunk, tasks)
+    scores = numpy.fromiter((s for chunk in results for s in chunk), dtype=float, count=len(distinct))
+
+    result = numpy.full(len(left), numpy.nan)
+    result[present] = scores[inverse]
+    result[numpy.isnan(result)] = missing_value
+    return result
+
+
+class Compare:
+    # Mirrors the recordlinkage.Compare methods the dedupe and matching
+    # scripts use so it can be swapped in directly.
+    def __init__(self, jobs=1, chunk_size=CHUNK_SIZE):
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.features = []
+
+    def string(self, left_on, right_on, method="levenshtein", label=None, missing_value=0.0):
+        if method not in METHODS:
+            raise ValueError(f"The algorithm '{method}' is not supported.")
+        self.features.append((left_on, right_on, method, label, missing_value))
+
+    def compute(self, pairs, x, x_link=None):
+        if x_link is None:
+            x_link = x
+        columns = {}
+        pool = multiprocessing.Pool(self.jobs) if self.jobs > 1 else None
+        try:
+            for i, (left_on, right_on, method, label, missing_value) in enumerate(self.features):
+                left, right = pair_values(pairs, x, x_link, left_on, right_on)
+                columns[i if label is None else label] = score(method, left, right, missing_value,
+                                                               chunk_size=self.chunk_size, pool=pool)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return pandas.DataFrame(columns, index=pairs)
@@ -0,0 +1,239 @@
+import collections
+
+# Each function here fetches one page section for every entity loaded with
+# load_keys() in a single query, so a site build runs a fixed number of
+# queries no matter how many pages it renders.
+
+
+def grouped(cursor, key):
+    cols = [x[0] for x in cursor.description]
+    result = collections.defaultdict(list)
+    for x in cursor:
+        row = dict(zip(cols, x))
+        row.pop("n", None)
+        result[row[key]].append(row)
+    return result
+
+
+def load_keys(db, name, keys):
+    # name gets a _keys suffix by convention so the temp table can't hide a
+    # table in raw.db, like the donors table entities.py builds.
+    db.execute(f"DROP TABLE IF EXISTS temp.[{name}]")
+    db.execute(f"CREATE TEMP TABLE [{name}] ([key] PRIMARY KEY)")
+    db.executemany(f"INSERT OR IGNORE INTO temp.[{name}] VALUES (?)", ((key,) for key in keys))
+
+
+def vip_contributors(db, threshold=50000):
+    cursor = db.execute("select contributor_name from contributor_year_totals group by contributor_name having SUM(total) > ?", (threshold,))
+    return {row[0] for row in cursor}
+
+
+def active_filers(db, since=2020):
+    cursor = db.execute("select filer_id from filer_totals where election_year >= ? group by filer_id", (since,))
+    return {row[0] for row in cursor}
+
+
+def top_employers(db, threshold):
+    # Names with a / can't be served from a single path segment.
+    cursor = db.execute("""select contributor_employer_name from employer_year_totals
+        where contributor_employer_name not like '%/%' group by contributor_employer_name having SUM(total) > ?""", (threshold,))
+    return {row[0] for row in cursor}
+
+
+def registered_filers(db):
+    cursor = db.execute("""select distinct filer_id from registrations, registrations_filer_name
+        where filer_name_id = registrations_filer_name.id AND filer_id in (select key from temp.filer_keys)""")
+    return {row[0] for row in cursor}
+
+
+def filer_info(db):
+    return grouped(db.execute("""select * from (
+        select filer_id, election_year, filer_type_id, filer_name, office, jurisdiction, political_committee_type, position, url,
+               row_number() over (partition by filer_id order by election_year desc) as n
+        from registrations, registrations_filer_name
+        where filer_name_id = registrations_filer_name.id AND filer_id in (select key from temp.filer_keys))
+        where n = 1"""), "filer_id")
+
+
+def filer_top_contributors(db, limit=10):
+    return grouped(db.execute("""select * from (
+        select filer_id, contributor_name, code_id, total,
+               row_number() over (partition by filer_id order by total desc) as n
+        from contributor_filer_totals where filer_id in (select key from temp.filer_keys))
+        where n <= ? order by filer_id, n""", (limit,)), "filer_id")
+
+
+def filer_recent_contributions(db, limit=20):
+    # Names are joined on after the window so only the rows shown need them.
+    return grouped(db.execute("""select filer_id, r.rowid, receipt_date, cash_or_in_kind_id, contributor_name, contributor_occupation, contributor_employer_name, amount, url, code_id from (
+        select filer_id, rowid, receipt_date, cash_or_in_kind_id, contributor_name_id, contributor_occupation, contributor_employer_name_id, amount, url, code_id,
+               row_number() over (partition by filer_id order by receipt_date desc, rowid desc) as n
+        from contributions where filer_id in (select key from temp.filer_keys)) r
+        left join contributions_contributor_name on contributions_contributor_name.id = contributor_name_id
+        left join contributions_contributor_employer_name on contributions_contributor_employer_name.id = contributor_employer_name_id
+        where n <= ? order by filer_id, n""", (limit,)), "filer_id")
+
+
+def filer_recent_expenditures(db, limit=20):
+    return grouped(db.execute("""select * from (
+        select filer_id, rowid, expenditure_date, recipient_name, description, amount, url,
+               row_number() over (partition by filer_id order by expenditure_date desc, rowid desc) as n
+        from expenditures where filer_id in (select key from temp.filer_keys))
+        where n <= ? order by filer_id, n""", (limit,)), "filer_id")
+
+
+def donor_top_filers(db, limit=10):
+    return grouped(db.execute("""select * from (
+        select contributor_name, type_id, filer_name, filer_id, total,
+               row_number() over (partition by contributor_name order by total desc) as n
+        from contributor_filer_totals, contributions_filer_name
+        where filer_name_id = contributions_filer_name.id AND contributor_name in (select key from temp.donor_keys))
+        where n <= ? order by contributor_name, n""", (limit,)), "contributor_name")
+
+
+def donor_year_totals(db, limit=50):
+    return grouped(db.execute("""select * from (
+        select contributor_name, year, total,
+               row_number() over (partition by contributor_name order by year desc) as n
+        from contributor_year_totals where contributor_name in (select key from temp.donor_keys))
+        where n <= ? order by contributor_name, n""", (limit,)), "contributor_name")
+
+
+def donor_recent_donations(db, limit=20):
+    return grouped(db.execute("""select * from (
+        select contributor_name, receipt_date, type_id, filer_name, filer_id, amount,
+               row_number() over (partition by contributor_name order by receipt_date desc, contributions.rowid desc) as n
+        from contributions_contributor_name cross join contributions on contributor_name_id = contributions_contributor_name.id, contributions_filer_name
+        where filer_name_id = contributions_filer_name.id AND contributions_contributor_name.contributor_name in (select key from temp.donor_keys))
+        where n <= ? order by contributor_name, n""", (limit,)), "contributor_name")
+
+
+def canonical_donors(db):
+    # True once update.py has built the donor tables from entities.py.
+    return db.execute("select 1 from sqlite_master where type = 'table' and name = 'donor_totals'").fetchone() is not None
+
+
+def canonical_vip_contributors(db, threshold=50000):
+    cursor = db.execute("""select donors.contributor_name from donor_year_totals, donors
+        where donors.donor_id = donor_year_totals.donor_id group by donor_year_totals.donor_id having SUM(total) > ?""", (threshold,))
+    return {row[0] for row in cursor}
+
+
+def load_donor_ids(db):
+    # Donor pages are still addressed by name. Names dedupe_runner.py hasn't
+    # seen yet get a NULL donor_id and fall back to the per name tables.
+    db.execute("DROP TABLE IF EXISTS temp.donor_ids")
+    db.execute("""CREATE TEMP TABLE donor_ids AS select key, donor_id from temp.donor_keys
+        left join donor_names on donor_names.contributor_name = temp.donor_keys.key""")
+
+
+def donor_aliases(db):
+    return grouped(db.execute("""select key as donor_name, donor_names.contributor_name from temp.donor_ids
+        cross join donor_names on donor_names.donor_id = temp.donor_ids.donor_id
+        where donor_names.contributor_name != key order by key, donor_names.contributor_name"""), "donor_name")
+
+
+def canonical_donor_top_filers(db, limit=10):
+    return grouped(db.execute("""select * from (
+        select contributor_name, type_id, filer_name, filer_id, total,
+               row_number() over (partition by contributor_name order by total desc) as n
+        from (select key as contributor_name, type_id, filer_name_id, filer_id, total from temp.donor_ids
+                  cross join donor_filer_totals on donor_filer_totals.donor_id = temp.donor_ids.donor_id
+              union all
+              select contributor_name, type_id, filer_name_id, filer_id, total from contributor_filer_totals
+                  where contributor_name in (select key from temp.donor_ids where donor_id is null)) t, contributions_filer_name
+        where filer_name_id = contributions_filer_name.id)
+        where n <= ? order by contributor_name, n""", (limit,)), "contributor_name")
+
+
+def canonical_donor_year_totals(db, limit=50):
+    return grouped(db.execute("""select * from (
+        select contributor_name, year, total,
+               row_number() over (partition by contributor_name order by year desc) as n
+        from (select key as contributor_name, year, total from temp.donor_ids
+                  cross join donor_year_totals on donor_year_totals.donor_id = temp.donor_ids.donor_id
+              union all
+              select contributor_name, year, total from contributor_year_totals
+                  where contributor_name in (select key from temp.donor_ids where donor_id is null)))
+        where n <= ? order by contributor_name, n""", (limit,)), "contributor_name")
+
+
+def canonical_donor_recent_donations(db, limit=20):
+    return grouped(db.execute("""select * from (
+        select contributor_name, receipt_date, type_id, filer_name, filer_id, amount,
+               row_number() over (partition by contributor_name order by receipt_date desc, contribution_rowid desc) as n
+        from (select key as contributor_name, receipt_date, type_id, filer_name_id, filer_id, amount, contributions.rowid as contribution_rowid
+                  from temp.donor_ids
+                  cross join contribution_donors on contribution_donors.donor_id = temp.donor_ids.donor_id
+                  cross join contributions on contributions.rowid = contribution_donors.contribution_rowid
+                  where not is_transfer
+              union all
+              select contributor_name, receipt_date, type_id, filer_name_id, filer_id, amount, contributions.rowid
+                  from contributions_contributor_name cross join contributions on contributor_name_id = contributions_contributor_name.id
+                  where contributor_name in (select key from temp.donor_ids where donor_id is null)) t, contributions_filer_name
+        where filer_name_id = contributions_filer_name.id)
+        where n <= ? order by contributor_name, n""", (limit,)), "contributor_name")
+
+
+def employer_top_filers(db, limit=10):
+    return grouped(db.execute("""select * from (
+        select contributor_employer_name, type_id, filer_name, filer_id, total,
+               row_number() over (partition by contributor_employer_name order by total desc) as n
+        from employer_filer_totals, contributions_filer_name
+        where filer_name_id = contributions_filer_name.id AND contributor_employer_name in (select key from temp.employer_keys))
+        where n <= ? order by contributor_employer_name, n""", (limit,)), "contributor_employer_name")
+
+
+def employer_year_totals(db, limit=50):
+    return grouped(db.execute("""select * from (
+        select contributor_employer_name, year, total,
+               row_number() over (partition by contributor_employer_name order by year desc) as n
+        from employer_year_totals where contributor_employer_name in (select key from temp.employer_keys))
+        where n <= ? order by contributor_employer_name, n""", (limit,)), "contributor_employer_name")
+
+
+def employer_recent_donations(db, limit=20):
+    return grouped(db.execute("""select contributor_employer_name, receipt_date, type_id, filer_name, filer_id, contributor_name, amount from (
+        select contributor_employer_name, receipt_date, type_id, filer_name, filer_id, contributor_name_id, amount,
+               row_number() over (partition by contributor_employer_name order by receipt_date desc, contributions.rowid desc) as n
+        from contributions_contributor_employer_name cross join contributions on contributor_employer_name_id = contributions_contributor_employer_name.id, contributions_filer_name
+        where filer_name_id = contributions_filer_name.id AND contributor_employer_name in (select key from temp.employer_keys)) r
+        left join contributions_contributor_name on contributions_contributor_name.id = contributor_name_id
+        where n <= ? order by contributor_employer_name, n""", (limit,)), "contributor_employer_name")
+
+
+def year_fundraisers(db, years, limit=20):
+    return grouped(db.execute(f"""select * from (
+        select election_year, type_id, filer_name, filer_id, total,
+               row_number() over (partition by election_year order by total desc) as n
+        from filer_totals, contributions_filer_name
+        where filer_name_id = contributions_filer_name.id and election_year in ({", ".join("?" * len(years))}))
+        where n <= ? order by election_year, n""", (*years, limit)), "election_year")
+
+
+def year_contributors(db, years, limit=20):
+    return grouped(db.execute(f"""select * from (
+        select election_year, contributor_name, code_id, total_amount,
+               row_number() over (partition by election_year order by total_amount desc) as n
+        from contribution_totals where election_year in ({", ".join("?" * len(years))}))
+        where n <= ? order by election_year, n""", (*years, limit)), "election_year")
+
+
+def canonical_year_contributors(db, years, limit=20):
+    # Transfers between committees are already left out of donor_totals.
+    return grouped(db.execute(f"""select * from (
+        select election_year, contributor_name, code_id, total_amount,
+               row_number() over (partition by election_year order by total_amount desc) as n
+        from donor_totals cross join donors on donors.donor_id = donor_totals.donor_id
+        where election_year in ({", ".join("?" * len(years))}))
+        where n <= ? order by election_year, n""", (*years, limit)), "election_year")
+
+
+def election_filers(db, year):
+    # Registration and totals for every candidate loaded into temp.filer_keys.
+    return grouped(db.execute("""select r.filer_id, filer_name, filer_type_id, total, contributor_count from (
+        select filer_id, filer_name, filer_type_id, row_number() over (partition by filer_id) as n
+        from registrations, registrations_filer_name
+        where filer_name_id = registrations_filer_name.id and election_year = ? and filer_id in (select key from temp.filer_keys)) r
+        left join filer_totals on filer_totals.filer_id = r.filer_id and filer_totals.election_year = ?
+        where n = 1""", (year, year)), "filer_id")
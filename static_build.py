@@ -1,70 +1,44 @@
+import argparse
+import functools
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
 import sqlite3
+import time
 
 import jinja2
 import pathlib
 
-loader = jinja2.FileSystemLoader("templates")
-jinja_env = jinja2.Environment(loader=loader)
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
+import site_data
+from plugins import profiling
 
-index_data = []
-
-db = sqlite3.connect("raw.db")
-
-# TODO: Load a list of previously rendered filers and contributors so we
-# continue to generate them.
-filers = set()
-contributors = set()
-
-cursor = db.cursor()
-cursor.execute("select contributor_name, SUM(amount) as total from contributions group by contributor_name having total > 50000")
-for row in cursor.fetchall():
-    contributors.add(row[0])
-
-cursor.execute("select filer_id from contributions where election_year >= 2020 group by filer_id")
-for row in cursor.fetchall():
-    filers.add(row[0])
-
-bad_filer_ids = set()
-
-for filer_id in filers:
-    cursor = db.cursor()
-    filer_data = {"filer_id": filer_id}
-
-    cursor.execute("select election_year, filer_type_id, filer_name, office, jurisdiction, political_committee_type, position, url from registrations, registrations_filer_name where filer_name_id = registrations_filer_name.id AND filer_id = ? order by election_year desc limit 1", (filer_id,))
-    cols = [x[0] for x in cursor.description]
-    filer_data["info"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-    if not filer_data["info"]:
-        bad_filer_ids.add(filer_id)
-        continue
-
-    filer_data["info"] = filer_data["info"][0]
-
-    cursor.execute("select contributor_name, code_id, SUM(amount) as total from contributions where filer_id = ? group by contributor_name order by total desc limit 10", (filer_id,))
-    cols = [x[0] for x in cursor.description]
-    filer_data["contributors"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-    for row in filer_data["contributors"]:
-        row["vip"] = row["contributor_name"] in contributors
-
-    cursor.execute("select rowid, receipt_date, cash_or_in_kind_id, contributor_name, contributor_occupation, contributor_employer_name, amount, url, code_id from contributions where filer_id = ? order by receipt_date DESC limit 20", (filer_id,))
-    cols = [x[0] for x in cursor.description]
-    filer_data["contributions"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-    for row in filer_data["contributions"]:
-        row["vip"] = row["contributor_name"] in contributors
-
-    cursor.execute("select rowid, expenditure_date, recipient_name, description, amount, url from expenditures where filer_id = ? order by expenditure_date DESC limit 20", (filer_id,))
-    cols = [x[0] for x in cursor.description]
-    filer_data["expenditures"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-
-    filer_template = jinja_env.get_template("pages/filer/{filer_id}.html")
-
-    out = pathlib.Path("site")
-    filer_out = out / "filer" / filer_id / "index.html"
-    filer_out.parent.mkdir(parents=True, exist_ok=True)
-    filer_out.write_text(filer_template.render(**filer_data))
-
-# Remove filer ids we couldn't render
-filers -= bad_filer_ids
+out = pathlib.Path("site")
+templates = pathlib.Path("templates")
+static = pathlib.Path("static")
+manifest_path = pathlib.Path("build") / "site_manifest.json"
+asset_manifest_path = out / "asset-manifest.json"
+
+TEMPLATES = {
+    "filer": "pages/filer/{filer_id}.html",
+    "donor": "pages/donor/{donor_name}.html",
+    "employer": "pages/employer/{employer_name}.html",
+    "index": "pages/index.html",
+    "election": "pages/election/20211102.html",
+}
+
+# Entities handed to a worker at a time.
+CHUNK_SIZE = 250
+
+# Employers whose employees gave more than this get a static page. The rest
+# are rendered by datasette from the same template.
+EMPLOYER_THRESHOLD = 100000
 
 elections = [{"date": "20211102",
     "year": 2021,
@@ -96,85 +70,486 @@ elections = [{"date": "20211102",
     }
 }}]
 
-for year in range(2021, 2023):
-    year_data = {"year": year, "elections": []}
-
-    for election in elections:
-        if election["year"] == year:
-            year_data["elections"].append(election)
-
-    cursor = db.cursor()
-
-    cursor.execute("select type_id, filer_name, filer_id, sum(amount) as total from contributions, contributions_filer_name WHERE filer_name_id = contributions_filer_name.id and election_year = ? group by filer_id order by total DESC limit 20", (year,))
-    cols = [x[0] for x in cursor.description]
-    year_data["fundraisers"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-    for row in year_data["fundraisers"]:
-        row["vip"] = row["filer_id"] in filers
-
-    cursor.execute("select contributor_name, code_id, total_amount from contribution_totals where election_year = ? order by total_amount desc limit 20", (year,))
-    cols = [x[0] for x in cursor.description]
-    year_data["contributors"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-    for row in year_data["contributors"]:
-        row["vip"] = row["contributor_name"] in contributors
-    index_data.append(year_data)
-
-index_template = jinja_env.get_template("pages/index.html")
-
-out = pathlib.Path("site")
-(out / "index.html").write_text(index_template.render(data=reversed(index_data)))
-
-for contributor_name in contributors:
-    cursor = db.cursor()
-    contributor_data = {"contributor_name": contributor_name}
-
-    cursor.execute("select type_id, filer_name, filer_id, sum(amount) as total from contributions, contributions_filer_name where filer_name_id = contributions_filer_name.id AND contributor_name = ? group by filer_id order by total DESC limit 10", (contributor_name,))
-    cols = [x[0] for x in cursor.description]
-    filer_data["top_filers"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-    for row in filer_data["top_filers"]:
-        row["vip"] = row["filer_id"] in filers
-
-    cursor.execute("select strftime('%Y', receipt_date) as year, SUM(amount) as total from contributions where contributor_name = ? group by year order by year DESC limit 50", (contributor_name,))
-    cols = [x[0] for x in cursor.description]
-    filer_data["year_totals"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-
-    cursor.execute("select receipt_date, type_id, filer_name, filer_id, amount from contributions, contributions_filer_name where filer_name_id = contributions_filer_name.id AND contributor_name = ? order by receipt_date DESC limit 20", (contributor_name,))
-    cols = [x[0] for x in cursor.description]
-    filer_data["recent_donations"] = [dict(zip(cols, x)) for x in cursor.fetchall()]
-    for row in filer_data["recent_donations"]:
-        row["vip"] = row["filer_id"] in filers
-
-    filer_template = jinja_env.get_template("pages/donor/{donor_name}.html")
-
-    out = pathlib.Path("site")
-    filer_out = out / "donor" / contributor_name / "index.html"
-    filer_out.parent.mkdir(parents=True, exist_ok=True)
-    filer_out.write_text(filer_template.render(**filer_data))
-
-election_template = jinja_env.get_template("pages/election/20211102.html")
-
-for election in elections:
-    cursor = db.cursor()
+# Per process state set up by init_worker().
+worker = {}
+
+# With --profile every site_data section and template render is timed and
+# the queries each section ran are checked with EXPLAIN QUERY PLAN.
+PROFILE_SQL_LENGTH = 500
+
+
+def template_hashes():
+    # Every page extends cf_base.html and imports macros.html so a page's
+    # template hash covers all of the shared templates too.
+    shared = hashlib.sha256()
+    for path in sorted(templates.glob("*.html")):
+        shared.update(path.read_bytes())
+    hashes = {}
+    for kind, name in TEMPLATES.items():
+        h = shared.copy()
+        h.update((templates / name).read_bytes())
+        hashes[kind] = h.hexdigest()
+    return hashes
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:20]
+
+
+def compressed_paths(path):
+    paths = [path.with_name(path.name + ".gz")]
+    if brotli:
+        paths.append(path.with_name(path.name + ".br"))
+    return paths
+
+
+def compressed_current(path):
+    # Compressed copies are written after the page, so one older than the
+    # page was left behind by a build without --compress.
+    mtime = path.stat().st_mtime_ns
+    return all(p.exists() and p.stat().st_mtime_ns >= mtime for p in compressed_paths(path))
+
+
+def remove_compressed(path):
+    for compressed in (path.with_name(path.name + ".gz"), path.with_name(path.name + ".br")):
+        compressed.unlink(missing_ok=True)
+
+
+def compress(path, data):
+    # mtime=0 keeps the .gz identical between builds of the same page.
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, 9, mtime=0))
+    if brotli:
+        path.with_name(path.name + ".br").write_bytes(brotli.compress(data, mode=brotli.MODE_TEXT))
+
+
+def query_plan(db, sql):
+    if sql.split(None, 1)[0].lower() not in ("select", "with"):
+        return None
+    return profiling.plan_summary([row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}")])
+
+
+def profile_entry(name):
+    return worker["profile"].setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0, "queries": {}, "slowest": None})
+
+
+def record(name, duration, rows=0, db=None, statements=()):
+    entry = profile_entry(name)
+    entry["calls"] += 1
+    entry["seconds"] += duration
+    entry["rows"] += rows
+    if duration > entry["max_seconds"]:
+        entry["max_seconds"] = duration
+        # The expanded SQL carries the parameters of the slowest call.
+        entry["slowest"] = statements[-1][:PROFILE_SQL_LENGTH] if statements else None
+    for sql in statements:
+        # Keyed like the profiling plugin's report, so a query has the same
+        # shape in both.
+        _, shape = profiling.fingerprint(sql)
+        query = entry["queries"].get(shape)
+        if query is None:
+            if shape not in worker["plans"]:
+                worker["plans"][shape] = query_plan(db, sql)
+            query = entry["queries"][shape] = {"calls": 0, "plan": worker["plans"][shape]}
+        query["calls"] += 1
+
+
+def result_rows(result):
+    if isinstance(result, dict):
+        return sum(len(rows) for rows in result.values())
+    if isinstance(result, (set, list)):
+        return len(result)
+    return 0
+
+
+def profile_section(name, function):
+    @functools.wraps(function)
+    def profiled(db, *args, **kwargs):
+        statements = []
+        db.set_trace_callback(statements.append)
+        start = time.perf_counter()
+        try:
+            result = function(db, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            db.set_trace_callback(None)
+        record(f"site_data.{name}", duration, result_rows(result), db, statements)
+        return result
+    return profiled
+
+
+def init_worker(contributors, filers, previous, styles_version, precompress, canonical, profile=False):
+    loader = jinja2.FileSystemLoader(str(templates))
+    jinja_env = jinja2.Environment(loader=loader)
+    worker["templates"] = {name: jinja_env.get_template(path) for name, path in TEMPLATES.items()}
+    worker["template_hashes"] = template_hashes()
+    worker["db"] = sqlite3.connect("file:raw.db?mode=ro", uri=True)
+    worker["contributors"] = contributors
+    worker["filers"] = filers
+    worker["previous"] = previous
+    worker["styles_version"] = styles_version
+    worker["compress"] = precompress
+    worker["canonical"] = canonical
+    worker["profile"] = {} if profile else None
+    worker["plans"] = {}
+    if profile:
+        for name, function in list(vars(site_data).items()):
+            if callable(function) and getattr(function, "__module__", None) == "site_data" and name != "grouped":
+                setattr(site_data, name, profile_section(name, function))
+
+
+def write_page(path, html):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = html.encode()
+    path.write_bytes(data)
+    return data
+
+
+def emit(kind, key, path, context):
+    # Only render pages whose inputs or templates changed since the last
+    # build.
+    context = dict(context, styles_version=worker["styles_version"])
+    inputs = hashlib.sha256(json.dumps(context, sort_keys=True, default=str).encode()).hexdigest()
+    page = path.relative_to(out).as_posix()
+    entry = {"kind": kind, "key": key, "inputs": inputs, "template": worker["template_hashes"][kind]}
+    previous = dict(worker["previous"].get(page, {}))
+    etag = previous.pop("etag", None)
+    rendered = previous != entry or not path.exists()
+    if rendered:
+        start = time.perf_counter()
+        html = worker["templates"][kind].render(**context)
+        if worker["profile"] is not None:
+            record(f"render.{kind}", time.perf_counter() - start)
+        data = write_page(path, html)
+        etag = content_hash(data)
+        if not worker["compress"]:
+            # Don't leave the old page's .gz or .br to be served instead.
+            remove_compressed(path)
+    if worker["compress"] and (rendered or not compressed_current(path)):
+        compress(path, path.read_bytes())
+    entry["etag"] = etag
+    return page, entry, rendered
+
+
+def render_filers(filer_ids):
+    db = worker["db"]
+    contributors = worker["contributors"]
+    site_data.load_keys(db, "filer_keys", filer_ids)
+    info = site_data.filer_info(db)
+    top_contributors = site_data.filer_top_contributors(db)
+    recent_contributions = site_data.filer_recent_contributions(db)
+    recent_expenditures = site_data.filer_recent_expenditures(db)
+
+    results = []
+    for filer_id in filer_ids:
+        filer_data = {"filer_id": filer_id, "info": info[filer_id][0]}
+
+        filer_data["contributors"] = top_contributors[filer_id]
+        for row in filer_data["contributors"]:
+            row["vip"] = row["contributor_name"] in contributors
+
+        filer_data["contributions"] = recent_contributions[filer_id]
+        for row in filer_data["contributions"]:
+            row["vip"] = row["contributor_name"] in contributors
+
+        filer_data["expenditures"] = recent_expenditures[filer_id]
+
+        results.append(emit("filer", filer_id, out / "filer" / filer_id / "index.html", filer_data))
+    return results
+
+
+def render_donors(contributor_names):
+    db = worker["db"]
+    filers = worker["filers"]
+    site_data.load_keys(db, "donor_keys", contributor_names)
+    if worker["canonical"]:
+        # Totals for everyone dedupe_runner.py put in the same cluster.
+        site_data.load_donor_ids(db)
+        aliases = site_data.donor_aliases(db)
+        top_filers = site_data.canonical_donor_top_filers(db)
+        year_totals = site_data.canonical_donor_year_totals(db)
+        recent_donations = site_data.canonical_donor_recent_donations(db)
+    else:
+        aliases = {}
+        top_filers = site_data.donor_top_filers(db)
+        year_totals = site_data.donor_year_totals(db)
+        recent_donations = site_data.donor_recent_donations(db)
+
+    results = []
+    for contributor_name in contributor_names:
+        contributor_data = {"donor_name": contributor_name}
+        contributor_data["aliases"] = [row["contributor_name"] for row in aliases.get(contributor_name, [])]
+
+        contributor_data["top_filers"] = top_filers[contributor_name]
+        for row in contributor_data["top_filers"]:
+            row["vip"] = row["filer_id"] in filers
+
+        contributor_data["year_totals"] = year_totals[contributor_name]
+
+        contributor_data["recent_donations"] = recent_donations[contributor_name]
+        for row in contributor_data["recent_donations"]:
+            row["vip"] = row["filer_id"] in filers
+
+        results.append(emit("donor", contributor_name, out / "donor" / contributor_name / "index.html", contributor_data))
+    return results
+
+
+def render_employers(employer_names):
+    db = worker["db"]
+    site_data.load_keys(db, "employer_keys", employer_names)
+    top_filers = site_data.employer_top_filers(db)
+    year_totals = site_data.employer_year_totals(db)
+    recent_donations = site_data.employer_recent_donations(db)
+
+    results = []
+    for employer_name in employer_names:
+        employer_data = {
+            "employer_name": employer_name,
+            "top_filers": top_filers[employer_name],
+            "year_totals": year_totals[employer_name],
+            "recent_donations": recent_donations[employer_name],
+        }
+        results.append(emit("employer", employer_name, out / "employer" / employer_name / "index.html", employer_data))
+    return results
+
+
+def render_index(years):
+    db = worker["db"]
+    index_data = []
+    fundraisers = site_data.year_fundraisers(db, years)
+    if worker["canonical"]:
+        top_contributors = site_data.canonical_year_contributors(db, years)
+    else:
+        top_contributors = site_data.year_contributors(db, years)
+    for year in years:
+        year_data = {"year": year, "elections": []}
+
+        for election in elections:
+            if election["year"] == year:
+                year_data["elections"].append(election)
+
+        year_data["fundraisers"] = fundraisers[year]
+        for row in year_data["fundraisers"]:
+            row["vip"] = row["filer_id"] in worker["filers"]
+
+        year_data["contributors"] = top_contributors[year]
+        for row in year_data["contributors"]:
+            row["vip"] = row["contributor_name"] in worker["contributors"]
+        index_data.append(year_data)
+
+    return [emit("index", None, out / "index.html", {"data": list(reversed(index_data))})]
+
+
+def render_election(election):
+    db = worker["db"]
+    candidates = [filer_id for positions in election["jurisdictions"].values() for ids in positions.values() for filer_id in ids]
+    site_data.load_keys(db, "filer_keys", candidates)
+    candidate_data = site_data.election_filers(db, election["year"])
+    jurisdictions = {}
     for jurisdiction, positions in election["jurisdictions"].items():
-        for position, filers in positions.items():
+        jurisdictions[jurisdiction] = {}
+        for position, ids in positions.items():
             new_filer_data = []
-            for filer_id in filers:
-                filer_data = {"filer_id": filer_id}
-                cursor.execute("select filer_name, filer_id, filer_type_id from registrations, registrations_filer_name where filer_name_id = registrations_filer_name.id and election_year = 2021 and filer_id = ? LIMIT 1", (filer_id,))
-                cols = [x[0] for x in cursor.description]
-                filer_data["filer"] = [dict(zip(cols, x)) for x in cursor.fetchall()][0]
-
-                cursor.execute("select sum(amount) as total from contributions where election_year = 2021 and filer_id = ?", (filer_id,))
-                cols = [x[0] for x in cursor.description]
-                filer_data["totals"] = [dict(zip(cols, x)) for x in cursor.fetchall()][0]
-
-                cursor.execute("select count(distinct contributor_name) as count from contributions where election_year = 2021 and filer_id = ?", (filer_id,))
-                cols = [x[0] for x in cursor.description]
-                filer_data["contributors"] = [dict(zip(cols, x)) for x in cursor.fetchall()][0]
-                new_filer_data.append(filer_data)
-            positions[position] = new_filer_data
-
-
-    out = pathlib.Path("site")
-    election_out = out / "election" / election["date"] / "index.html"
-    election_out.parent.mkdir(parents=True, exist_ok=True)
-    election_out.write_text(election_template.render(**election))
+            for filer_id in ids:
+                candidate = candidate_data[filer_id][0]
+                new_filer_data.append({
+                    "filer_id": filer_id,
+                    "filer": candidate,
+                    "totals": {"total": candidate["total"]},
+                    "contributors": {"count": candidate["contributor_count"] or 0},
+                })
+            jurisdictions[jurisdiction][position] = new_filer_data
+
+    return [emit("election", election["date"], out / "election" / election["date"] / "index.html",
+                 dict(election, jurisdictions=jurisdictions))]
+
+
+def run_task(task):
+    kind, arg = task
+    start = time.monotonic()
+    results = RENDERERS[kind](arg)
+    # Each task hands back what it profiled so main() can add it up.
+    profile = worker["profile"]
+    if profile is not None:
+        worker["profile"] = {}
+    return kind, results, time.monotonic() - start, profile
+
+
+RENDERERS = {
+    "filer": render_filers,
+    "donor": render_donors,
+    "employer": render_employers,
+    "index": render_index,
+    "election": render_election,
+}
+
+
+def chunks(kind, keys):
+    keys = sorted(keys)
+    return [(kind, keys[i:i + CHUNK_SIZE]) for i in range(0, len(keys), CHUNK_SIZE)]
+
+
+def load_manifest():
+    try:
+        return json.loads(manifest_path.read_text())["pages"]
+    except FileNotFoundError:
+        return {}
+
+
+def copy_static(precompress):
+    # Copy static/ into the site, leaving unchanged files alone, and return
+    # each file's content hash.
+    hashes = {}
+    for source in sorted(static.rglob("*")):
+        if not source.is_file():
+            continue
+        data = source.read_bytes()
+        target = out / "static" / source.relative_to(static)
+        if not target.exists() or target.read_bytes() != data:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            if precompress:
+                compress(target, data)
+            else:
+                remove_compressed(target)
+        elif precompress and not compressed_current(target):
+            compress(target, data)
+        hashes[target.relative_to(out).as_posix()] = content_hash(data)
+    return hashes
+
+
+def write_asset_manifest(pages, static_hashes):
+    # URL path to content hash, for ETags and cache busting.
+    assets = {"/" + page.removesuffix("index.html"): entry["etag"] for page, entry in pages.items()}
+    assets.update({"/" + path: h for path, h in static_hashes.items()})
+    asset_manifest_path.write_text(json.dumps(assets, indent=1, sort_keys=True))
+
+
+def remove_page(page):
+    path = out / page
+    path.unlink(missing_ok=True)
+    remove_compressed(path)
+    # Clean up the now empty entity directories.
+    for parent in path.parents:
+        if parent == out or any(parent.iterdir()):
+            break
+        parent.rmdir()
+
+
+def merge_profile(total, profile):
+    for name, entry in profile.items():
+        merged = total.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0, "queries": {}, "slowest": None})
+        merged["calls"] += entry["calls"]
+        merged["seconds"] += entry["seconds"]
+        merged["rows"] += entry["rows"]
+        if entry["max_seconds"] > merged["max_seconds"]:
+            merged["max_seconds"] = entry["max_seconds"]
+            merged["slowest"] = entry["slowest"]
+        for shape, query in entry["queries"].items():
+            merged_query = merged["queries"].setdefault(shape, {"calls": 0, "plan": query["plan"]})
+            merged_query["calls"] += query["calls"]
+
+
+def print_profile(profile):
+    print("Profile, by worker time:")
+    for name, entry in sorted(profile.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        scans = sorted({scan for query in entry["queries"].values() if query["plan"] for scan in query["plan"]["scans"]})
+        temp = any(query["plan"] and query["plan"]["temp_b_tree"] for query in entry["queries"].values())
+        print(f"{name:>45}: {entry['seconds']:8.2f}s in {entry['calls']} calls, max {entry['max_seconds'] * 1000:.1f}ms, {entry['rows']} rows"
+              f"{', ' + '; '.join(scans) if scans else ''}{', temp b-tree' if temp else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Worker processes to render with. 1 renders serially.")
+    parser.add_argument("--force", action="store_true", help="Render every page even if its inputs haven't changed")
+    parser.add_argument("--employer-threshold", type=float, default=EMPLOYER_THRESHOLD, help="Render static pages for employers above this total")
+    parser.add_argument("--compress", action="store_true", help="Write .gz (and .br if brotli is installed) next to every page")
+    parser.add_argument("--raw-names", action="store_true", help="Group donors by contributor_name even if canonical donors have been built")
+    parser.add_argument("--profile", action="store_true", help="Time every site_data query and template render and check the query plans")
+    args = parser.parse_args()
+    if args.compress and not brotli:
+        print("brotli isn't installed, only writing .gz files")
+
+    start = time.monotonic()
+    # Loaded even with --force, which only skips the up to date check, so
+    # pages that aren't rendered any more are still found and deleted.
+    previous = load_manifest()
+    db = sqlite3.connect("file:raw.db?mode=ro", uri=True)
+
+    # Only what this build's queries find is rendered. Pages from earlier
+    # builds that aren't in it, like donors who dropped below a threshold,
+    # are deleted as orphans below.
+    canonical = site_data.canonical_donors(db) and not args.raw_names
+    if canonical:
+        contributors = site_data.canonical_vip_contributors(db)
+    else:
+        contributors = site_data.vip_contributors(db)
+    employers = site_data.top_employers(db, args.employer_threshold)
+    filers = site_data.active_filers(db)
+    site_data.load_keys(db, "filer_keys", filers)
+    # Filers without a registration can't be rendered.
+    filers = site_data.registered_filers(db)
+    db.close()
+    print(f"Found {len(filers)} filers, {len(contributors)} donors and {len(employers)} employers in {time.monotonic() - start:.1f}s")
+
+    static_hashes = copy_static(args.compress)
+    styles_version = static_hashes.get("static/styles.css")
+
+    tasks = chunks("filer", filers) + chunks("donor", contributors) + chunks("employer", employers)
+    tasks.append(("index", list(range(2021, 2023))))
+    tasks.extend(("election", election) for election in elections)
+
+    up_to_date = {} if args.force else previous
+    pages = {}
+    counts = {}
+    seconds = {}
+    profile = {}
+    start = time.monotonic()
+    if args.jobs == 1:
+        init_worker(contributors, filers, up_to_date, styles_version, args.compress, canonical, args.profile)
+        results = map(run_task, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(args.jobs, initializer=init_worker, initargs=(contributors, filers, up_to_date, styles_version, args.compress, canonical, args.profile))
+        results = pool.imap_unordered(run_task, tasks)
+    for kind, task_results, duration, task_profile in results:
+        if task_profile:
+            merge_profile(profile, task_profile)
+        rendered, skipped = counts.get(kind, (0, 0))
+        for page, entry, was_rendered in task_results:
+            pages[page] = entry
+            if was_rendered:
+                rendered += 1
+            else:
+                skipped += 1
+        counts[kind] = (rendered, skipped)
+        seconds[kind] = seconds.get(kind, 0) + duration
+    if pool:
+        pool.close()
+        pool.join()
+    duration = time.monotonic() - start
+
+    orphans = sorted(previous.keys() - pages.keys())
+    for page in orphans:
+        remove_page(page)
+
+    stats = {"rendered": sum(c[0] for c in counts.values()), "skipped": sum(c[1] for c in counts.values()), "deleted": len(orphans),
+             "seconds": duration, "kinds": {kind: {"rendered": rendered, "skipped": skipped, "seconds": seconds.get(kind, 0)}
+                                            for kind, (rendered, skipped) in counts.items()}}
+    if args.profile:
+        stats["profile"] = profile
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_text(json.dumps({"stats": stats, "pages": pages}, indent=1, sort_keys=True))
+    write_asset_manifest(pages, static_hashes)
+
+    for kind in RENDERERS:
+        rendered, skipped = counts.get(kind, (0, 0))
+        print(f"{kind}: {rendered} rendered, {skipped} unchanged, {seconds.get(kind, 0):.1f}s of worker time")
+    print(f"Rendered {stats['rendered']} pages, skipped {stats['skipped']} and deleted {stats['deleted']} "
+          f"in {duration:.1f}s with {args.jobs} jobs ({len(pages) / max(duration, 1e-9):.0f} pages/sec)")
+    if args.profile:
+        print_profile(profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import argparse
+import bisect
+import csv
+import itertools
+import pathlib
+import random
+
+import static_build
+
+# Fake PDC exports shaped like the real contributions, expenditures,
+# registrations and Seattle CSVs, for benchmark.py and for trying changes
+# without downloading anything. Donors are drawn with a long tail like the
+# real data, so a few give thousands of times and most give once, and some
+# rows spell the donor's name or address differently so the dedupe and
+# matching scripts have near duplicates to find. The same seed and row count
+# always give the same files.
+
+FIRST_NAMES = ["JOHN", "JANE", "MARY", "ROBERT", "LINDA", "SCOTT", "AMY", "PAT", "CHRIS", "SAM", "MICHAEL", "SUSAN",
+               "DAVID", "KAREN", "JAMES", "LISA", "DANIEL", "NANCY", "PAUL", "EMILY", "MARK", "ANNA", "KEVIN", "LAURA",
+               "BRIAN", "SARAH", "JASON", "RACHEL", "ERIC", "MEGAN", "PETER", "HELEN", "STEVEN", "JULIE", "THOMAS", "GRACE"]
+LAST_NAMES = ["SMITH", "JONES", "NGUYEN", "LEE", "GARCIA", "MILLER", "DAVIS", "WILSON", "TAYLOR", "CLARK", "JOHNSON",
+              "BROWN", "WILLIAMS", "ANDERSON", "THOMAS", "MOORE", "MARTIN", "JACKSON", "WHITE", "HARRIS", "LEWIS",
+              "ROBINSON", "WALKER", "YOUNG", "ALLEN", "KING", "WRIGHT", "SCOTT", "HILL", "GREEN", "ADAMS", "BAKER",
+              "NELSON", "CARTER", "MITCHELL", "PEREZ", "ROBERTS", "TURNER", "PHILLIPS", "CAMPBELL", "PARKER", "EVANS",
+              "EDWARDS", "COLLINS", "STEWART", "MORRIS", "MURPHY", "COOK", "ROGERS", "MORGAN", "PETERSON", "COOPER"]
+STREETS = ["NW MARKET ST", "15TH AVE NW", "LEARY WAY NW", "NW 65TH ST", "24TH AVE NW", "PINE ST", "E MADISON ST",
+           "RAINIER AVE S", "AURORA AVE N", "CALIFORNIA AVE SW", "N 45TH ST", "BROADWAY E", "DEXTER AVE N",
+           "BEACON AVE S", "NE 55TH ST", "FAUNTLEROY WAY SW", "GREENWOOD AVE N", "EASTLAKE AVE E", "1ST AVE", "3RD AVE"]
+CITIES = [("SEATTLE", "WA", z) for z in (98101, 98102, 98103, 98105, 98107, 98109, 98112, 98115, 98116, 98117,
+                                           98118, 98122, 98125, 98126, 98133, 98144, 98199)] + \
+         [("BELLEVUE", "WA", 98004), ("TACOMA", "WA", 98402), ("SPOKANE", "WA", 99201), ("PORTLAND", "OR", 97201)]
+OCCUPATIONS = ["ENGINEER", "TEACHER", "ATTORNEY", "RETIRED", "NURSE", "MANAGER", "PHYSICIAN", "SOFTWARE DEVELOPER",
+               "CONSULTANT", "NOT EMPLOYED", "OWNER", "ARCHITECT", "SALES", "ACCOUNTANT", ""]
+EMPLOYERS = ["MICROSOFT", "AMAZON", "BOEING", "SELF", "RETIRED", "UNIVERSITY OF WASHINGTON", "NONE", "STARBUCKS",
+             "COSTCO", "NORDSTROM", "SEATTLE CHILDRENS", "KING COUNTY", "CITY OF SEATTLE", "ALASKA AIRLINES", "EXPEDIA",
+             "ZILLOW", "T-MOBILE", "PACCAR", "WEYERHAEUSER", "FRED HUTCH"]
+VENDORS = ["STRATEGIES 360", "FACEBOOK", "GOOGLE", "US POSTAL SERVICE", "MAIL PRINTING CO", "CAMPAIGN DATA INC",
+           "ACTBLUE", "PAYROLL SERVICES", "SIGNS NOW", "RADIO ADS LLC"]
+OFFICES = ["MAYOR", "CITY COUNCIL MEMBER", "CITY ATTORNEY", "COUNTY EXECUTIVE", "COUNTY COUNCIL MEMBER",
+           "PORT COMMISSIONER", "STATE REPRESENTATIVE", "STATE SENATOR"]
+YEARS = [2019, 2020, 2021, 2022, 2023]
+# code, weight. Individuals are most of the rows, like the real data.
+CODES = [("Individual", 80), ("Business", 8), ("Self", 3), ("Political Action Committee", 4), ("Political Party", 2),
+         ("Candidate", 1), ("Caucus", 1), ("Other", 1)]
+
+CONTRIBUTION_COLUMNS = ["id", "report_number", "origin", "committee_id", "filer_id", "type", "filer_name", "office",
+                        "legislative_district", "position", "party", "jurisdiction", "jurisdiction_county",
+                        "jurisdiction_type", "election_year", "amount", "cash_or_in_kind", "receipt_date", "description",
+                        "memo", "primary_general", "code", "contributor_category", "contributor_name",
+                        "contributor_address", "contributor_city", "contributor_state", "contributor_zip",
+                        "contributor_occupation", "contributor_employer_name", "contributor_employer_city",
+                        "contributor_employer_state", "url"]
+EXPENDITURE_COLUMNS = ["id", "report_number", "origin", "committee_id", "filer_id", "type", "filer_name", "office",
+                       "legislative_district", "position", "party", "jurisdiction", "jurisdiction_county",
+                       "jurisdiction_type", "election_year", "amount", "itemized_or_non_itemized", "expenditure_date",
+                       "description", "code", "recipient_name", "recipient_address", "recipient_city",
+                       "recipient_state", "recipient_zip", "url"]
+REGISTRATION_COLUMNS = ["id", "filer_id", "filer_type", "filer_name", "committee_id", "election_year", "office",
+                        "jurisdiction", "political_committee_type", "position", "party", "committee_address",
+                        "committee_city", "committee_state", "committee_zip", "treasurer_name", "treasurer_zip", "url"]
+SEATTLE_COLUMNS = ["Election Year", "Candidate", "Contributor", "Address", "Zip", "Amount", "Date", "Employer", "Occupation"]
+
+
+def date(rng, year):
+    return f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{year}"
+
+
+def misspell(rng, value):
+    # The kinds of variation the PDC data has for the same donor.
+    choice = rng.randrange(4)
+    if choice == 0 and " " in value:
+        first, rest = value.split(" ", 1)
+        return f"{first} {rng.choice('ABCDEJKLMRST')} {rest}"
+    if choice == 1:
+        return value.replace(" ST", " STREET").replace(" AVE", " AVENUE")
+    if choice == 2 and len(value) > 3:
+        i = rng.randrange(len(value) - 1)
+        return value[:i] + value[i + 1] + value[i] + value[i + 2:]
+    return value.lower().title()
+
+
+class Population:
+    # Donors, filers and committees for a data set of `rows` contributions.
+    def __init__(self, rows, seed):
+        rng = random.Random(seed)
+        self.rng = rng
+        donor_count = max(200, rows // 8)
+        self.donors = []
+        for _ in range(donor_count):
+            city, state, zip_code = rng.choice(CITIES)
+            self.donors.append((
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                f"{rng.randint(100, 29999)} {rng.choice(STREETS)}",
+                city, state, zip_code,
+                rng.choice(OCCUPATIONS),
+                rng.choice(EMPLOYERS) if rng.random() < 0.7 else f"EMPLOYER {rng.randrange(max(20, rows // 500))}",
+            ))
+        # Zipf like weights so donor activity has a long tail.
+        self.donor_weights = list(itertools.accumulate(1 / (i + 1) ** 0.8 for i in range(donor_count)))
+
+        # The candidates static_build.py's election pages list come first.
+        known = [filer_id for election in static_build.elections
+                 for races in election["jurisdictions"].values() for filers in races.values() for filer_id in filers]
+        filer_count = max(len(known) + 40, rows // 2500)
+        self.filers = []
+        for i in range(filer_count):
+            last = rng.choice(LAST_NAMES)
+            filer_id = known[i] if i < len(known) else f"{last[:4]}{rng.choice(FIRST_NAMES)[0]}{' ' * 2 if rng.random() < 0.5 else '--'}{i:03d}"
+            is_candidate = rng.random() < 0.7
+            name = f"{rng.choice(FIRST_NAMES)} {last}" if is_candidate else f"CITIZENS FOR {rng.choice(STREETS).split()[-2]} {i}"
+            year = rng.choice(YEARS)
+            if i < len(known):
+                year = 2021
+            self.filers.append({
+                "filer_id": filer_id, "committee_id": 10000 + i, "filer_name": name,
+                "type": "Candidate" if is_candidate else "Political Committee",
+                "office": rng.choice(OFFICES) if is_candidate else "", "election_year": year,
+                "address": f"{rng.randint(100, 9999)} {rng.choice(STREETS)}",
+                "party": rng.choice(["DEMOCRAT", "REPUBLICAN", "NON PARTISAN", "INDEPENDENT"]),
+            })
+        self.filer_weights = list(itertools.accumulate(1 / (i + 1) ** 0.5 for i in range(filer_count)))
+        # (giver, receiver, amount, date) of the committee to committee
+        # contributions that get a matching expenditure.
+        self.transfers = []
+
+    def donor(self):
+        return self.donors[bisect.bisect(self.donor_weights, self.rng.random() * self.donor_weights[-1])]
+
+    def filer(self):
+        return self.filers[bisect.bisect(self.filer_weights, self.rng.random() * self.filer_weights[-1])]
+
+
+def filer_columns(filer):
+    return [filer["committee_id"], filer["filer_id"], filer["type"], filer["filer_name"], filer["office"], "",
+            "", filer["party"], "CITY OF SEATTLE", "KING", "LOCAL"]
+
+
+# Transfers the giving committee also reports as an expenditure.
+PAIRED_TRANSFERS = 0.6
+
+
+def write_contributions(path, population, rows, changed, seed):
+    rng = population.rng
+    # Its own generator so --changed doesn't shift any other value.
+    changes = random.Random(seed + 1)
+    codes = [code for code, _ in CODES]
+    code_weights = list(itertools.accumulate(weight for _, weight in CODES))
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CONTRIBUTION_COLUMNS)
+        for i in range(rows):
+            filer = population.filer()
+            code = codes[bisect.bisect(code_weights, rng.random() * code_weights[-1])]
+            if i < len(codes):
+                # ingest numbers codes in the order it first sees them, so
+                # the transfer codes get the ids 4 to 7 match_exp_cont.py
+                # reads as transfers.
+                code = codes[i]
+            giver = None
+            if code in ("Political Action Committee", "Political Party", "Candidate", "Caucus"):
+                # Committee to committee transfers, which match_exp_cont.py
+                # pairs with the giving committee's expenditure.
+                giver = population.filer()
+                name, address, city, state, zip_code, occupation, employer = giver["filer_name"], giver["address"], "SEATTLE", "WA", 98101, "", ""
+            else:
+                name, address, city, state, zip_code, occupation, employer = population.donor()
+            if rng.random() < 0.05:
+                name = misspell(rng, name)
+            if rng.random() < 0.05:
+                address = misspell(rng, address)
+            year = filer["election_year"] if rng.random() < 0.8 else rng.choice(YEARS)
+            amount = round(min(rng.paretovariate(1.2) * 20, 250000), 2)
+            receipt_date = date(rng, rng.choice((year - 1, year)))
+            if giver and rng.random() < PAIRED_TRANSFERS:
+                population.transfers.append((giver, filer, amount, receipt_date))
+            if changed and changes.random() < changed:
+                amount += 1
+            writer.writerow([i + 1, 100000 + i // 20, "C3" if rng.random() < 0.9 else "C4"] + filer_columns(filer) + [
+                year, f"{amount:.2f}", "Cash" if rng.random() < 0.95 else "In kind", receipt_date,
+                "", "", rng.choice(("Primary", "General", "Full election")), code,
+                "Individual" if code in ("Individual", "Self") else "Organization",
+                name, address, city, state, zip_code if rng.random() < 0.98 else "", occupation, employer,
+                "SEATTLE" if employer else "", "WA" if employer else "", f"https://www.pdc.wa.gov/report/{100000 + i // 20}"])
+
+
+def write_expenditures(path, population, rows):
+    rng = population.rng
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPENDITURE_COLUMNS)
+        # The giving side of the paired transfers: same amount, paid to the
+        # receiving committee the day it was reported or the day before.
+        # match_exp_cont.py's sorted neighbourhood only pairs dates next to
+        # each other.
+        for i, (giver, receiver, amount, receipt_date) in enumerate(population.transfers):
+            month, day, year = receipt_date.split("/")
+            writer.writerow([rows + i + 1, 300000 + i // 10, "B3"] + filer_columns(giver) + [
+                giver["election_year"], f"{amount:.2f}", "Itemized", f"{month}/{max(1, int(day) - rng.randint(0, 1)):02d}/{year}",
+                "CONTRIBUTION", "", receiver["filer_name"], receiver["address"],
+                "SEATTLE", "WA", 98101, f"https://www.pdc.wa.gov/report/{300000 + i // 10}"])
+        for i in range(rows):
+            filer = population.filer()
+            if rng.random() < 0.1:
+                recipient = population.filer()
+                name, address = recipient["filer_name"], recipient["address"]
+            else:
+                name, address = rng.choice(VENDORS), f"{rng.randint(100, 9999)} {rng.choice(STREETS)}"
+            year = filer["election_year"]
+            writer.writerow([i + 1, 200000 + i // 10, "B3"] + filer_columns(filer) + [
+                year, f"{round(min(rng.paretovariate(1.1) * 50, 500000), 2):.2f}",
+                "Itemized" if rng.random() < 0.9 else "Non-itemized", date(rng, rng.choice((year - 1, year))),
+                rng.choice(("ADS", "PRINTING", "POSTAGE", "CONSULTING", "CONTRIBUTION")), "", name, address,
+                "SEATTLE", "WA", 98101, f"https://www.pdc.wa.gov/report/{200000 + i // 10}"])
+
+
+def write_registrations(path, population):
+    rng = population.rng
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(REGISTRATION_COLUMNS)
+        for i, filer in enumerate(population.filers):
+            # Committees register again when they amend, like the real data.
+            for amendment in range(rng.randint(1, 3)):
+                writer.writerow([i * 10 + amendment, filer["filer_id"], filer["type"], filer["filer_name"],
+                                 filer["committee_id"], filer["election_year"], filer["office"], "CITY OF SEATTLE",
+                                 "" if filer["type"] == "Candidate" else "Continuing", "", filer["party"],
+                                 filer["address"], "SEATTLE", "WA", 98101, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                                 98101, f"https://www.pdc.wa.gov/registration/{i}"])
+
+
+def write_seattle(path, population, rows):
+    rng = population.rng
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SEATTLE_COLUMNS)
+        for _ in range(rows):
+            name, address, _, _, zip_code, occupation, employer = population.donor()
+            writer.writerow([2021, population.filer()["filer_name"], name, address, zip_code,
+                             rng.choice((25, 50, 100, 250)), date(rng, 2021), employer, occupation])
+
+
+def generate(directory, rows, seed=0, changed=0.0):
+    # Writes the four CSVs update.py reads into `directory`. `changed` is the
+    # fraction of contributions whose amount differs from the same seed
+    # without it, for timing incremental updates.
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    population = Population(rows, seed)
+    write_contributions(directory / "contributions.csv", population, rows, changed, seed)
+    write_expenditures(directory / "expenditures.csv", population, rows // 4)
+    write_registrations(directory / "registrations.csv", population)
+    write_seattle(directory / "seattle.csv", population, max(100, rows // 100))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic PDC CSVs for update.py --no-download")
+    parser.add_argument("directory", nargs="?", default="build", type=pathlib.Path)
+    parser.add_argument("--rows", type=int, default=100000, help="Contributions to write, 10000 to 10000000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--changed", type=float, default=0.0, help="Fraction of contributions to give a different amount")
+    args = parser.parse_args()
+    generate(args.directory, args.rows, args.seed, args.changed)
@@ -30,6 +30,8 @@ import sqlite3
 import dedupe
 import dedupe.backport
 
+import blocking_map
+
 def record_pairs(result_set):
     for i, row in enumerate(result_set):
         a_record_id, a_record, b_record_id, b_record = row
@@ -88,14 +90,14 @@ class SQLDict:
 
     def __len__(self):
         cur = self._con.cursor()
-        cur.execute("SELECT COUNT(*) FROM contributions  WHERE contributor_zip = 98107 GROUP BY contributor_category_id, contributor_name, contributor_address")
+        cur.execute("SELECT COUNT(*) FROM contributions_named WHERE contributor_zip = 98107 GROUP BY contributor_category_id, contributor_name, contributor_address")
         count = cur.fetchone()[0]
         print("count", count)
         return count
 
     def values(self):
         cur = self._con.cursor()
-        cur.execute("SELECT rowid, contributor_category_id, contributor_name, contributor_address FROM contributions WHERE contributor_zip = 98107 GROUP BY contributor_category_id, contributor_name, contributor_address")
+        cur.execute("SELECT rowid, contributor_category_id, contributor_name, contributor_address FROM contributions_named WHERE contributor_zip = 98107 GROUP BY contributor_category_id, contributor_name, contributor_address")
         return RowIter(cur)
 
     def __iter__(self):
@@ -171,23 +173,13 @@ else:
 
 print('blocking...')
 
-# To run blocking on such a large set of data, we create a separate table
-# that contains blocking keys and record ids
-print('creating blocking_map database')
-cur = con.cursor()
-cur.execute("DROP TABLE IF EXISTS blocking_map")
-cur.execute("CREATE TABLE blocking_map "
-            "(block_key VARCHAR(200), rowid INTEGER)")
-
-con.commit()
-
 # If dedupe learned a Index Predicate, we have to take a pass
 # through the data and create indices.
 print('creating inverted index')
 
 for field in deduper.fingerprinter.index_fields:
     cur = con.cursor()
-    cur.execute("SELECT DISTINCT {field} FROM contributions "
+    cur.execute("SELECT DISTINCT {field} FROM contributions_named "
                 "WHERE {field} IS NOT NULL AND contributor_zip = 98107".format(field=field))
     field_data = (row[0] for row in cur)
     deduper.fingerprinter.index(field_data, field)
@@ -197,47 +189,38 @@ for field in deduper.fingerprinter.index_fields:
 print('writing blocking map')
 
 read_cur = con.cursor()
-read_cur.execute("SELECT rowid, contributor_category_id, contributor_name, contributor_address FROM contributions WHERE contributor_zip = 98107 GROUP BY contributor_category_id, contributor_name, contributor_address")
+read_cur.execute("SELECT rowid, contributor_category_id, contributor_name, contributor_address FROM contributions_named WHERE contributor_zip = 98107 GROUP BY contributor_category_id, contributor_name, contributor_address")
 full_data = ((row['rowid'], row) for row in read_cur)
 b_data = deduper.fingerprinter(full_data)
 
-write_cur = con.cursor()
-write_cur.executemany("INSERT INTO blocking_map VALUES (?, ?)",
-                      b_data)
-con.commit()
+# To run blocking on such a large set of data, we write blocking keys and
+# record ids to a separate table in sorted batches
+blocking_map.write_blocking_map(con, b_data)
 
 # Free up memory by removing indices we don't need anymore
 deduper.fingerprinter.reset_indices()
 
-# indexing blocking_map
-print('creating index')
-cur = con.cursor()
-cur.execute("CREATE UNIQUE INDEX bm_idx ON blocking_map (block_key, rowid)")
-con.commit()
-
-# select unique pairs to compare
-read_cur = con.cursor()
-read_cur.execute("""
-       select a.rowid,
-              json_object('contributor_name', a.contributor_name,
-                          'contributor_address', a.contributor_address),
-              b.rowid,
-              json_object('contributor_name', b.contributor_name,
-                          'contributor_address', b.contributor_address)
-       from (select DISTINCT l.rowid as east, r.rowid as west
-             from blocking_map as l
-             INNER JOIN blocking_map as r
-             using (block_key)
-             where l.rowid < r.rowid) ids
-       INNER JOIN contributions a on ids.east=a.rowid
-       INNER JOIN contributions b on ids.west=b.rowid
-       """)
+# Huge blocks are mostly common tokens and would swamp the pair count
+stats = blocking_map.drop_oversized_blocks(con, blocking_map.MAX_BLOCK_SIZE)
+blocking_map.index_blocks(con)
 
 # ## Clustering
 
+# Pairs are streamed block by block and looked up a chunk at a time into
+# one generator. deduper.score doesn't list it: dedupe's scoreDuplicates
+# reads it 20000 pairs at a time through a two slot queue and the scoring
+# processes write to a numpy memmap in a temp file, so memory stays flat
+# however many pairs there are.
 print('clustering...')
-clustered_dupes = deduper.cluster(deduper.score(record_pairs(read_cur)),
-                                  threshold=0.5)
+stats.update(blocks=0, pairs=0)
+pairs = blocking_map.candidate_pairs(con, stats)
+chunks = blocking_map.record_pair_chunks(con, pairs, ("contributor_name", "contributor_address"), table="contributions_named")
+scores = deduper.score(itertools.chain.from_iterable(chunks))
+# candidate_pairs counts blocks and pairs as they're read, so the counts
+# are only complete now that score has used up the generator.
+print(f"{stats['blocks']} blocks, {stats['pairs']} pairs, skipped {stats['skipped_blocks']} blocks over "
+      f"{blocking_map.MAX_BLOCK_SIZE} records ({stats['skipped_fingerprints']} fingerprints)")
+clustered_dupes = deduper.cluster(scores, threshold=0.5)
 
 write_cur = con.cursor()
 
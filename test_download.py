@@ -0,0 +1,116 @@
+import contextlib
+import http.server
+import json
+import pathlib
+import tempfile
+import threading
+
+import download
+
+# download.fetch against a local server that honours If-None-Match and
+# Range/If-Range the way data.wa.gov does.
+
+
+class Resource(http.server.BaseHTTPRequestHandler):
+    body = b""
+    etag = ""
+    requests = []
+    # Bytes to leave off the end while still promising the whole body.
+    truncate = 0
+
+    def do_GET(self):
+        headers = dict(self.headers)
+        type(self).requests.append(headers)
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.etag)
+            self.end_headers()
+            return
+        start = 0
+        ranged = self.headers.get("Range")
+        # A stale If-Range gets the whole new resource.
+        if ranged and self.headers.get("If-Range") == self.etag:
+            start = int(ranged.removeprefix("bytes=").rstrip("-"))
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body) - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(self.body) - 1}/{len(self.body)}")
+        self.end_headers()
+        self.wfile.write(self.body[start:len(self.body) - self.truncate])
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serving(body, etag):
+    Resource.body, Resource.etag, Resource.requests, Resource.truncate = body, etag, [], 0
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Resource)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/contributions.csv"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unchanged():
+    with tempfile.TemporaryDirectory() as directory, serving(b"a,b\n1,2\n", '"v1"') as url:
+        path = pathlib.Path(directory) / "contributions.csv"
+        assert download.fetch(url, path) == "downloaded"
+        assert download.fetch(url, path) == "unchanged"
+        assert Resource.requests[-1]["If-None-Match"] == '"v1"'
+        assert path.read_bytes() == b"a,b\n1,2\n"
+
+
+def interrupted(path, url, data, etag):
+    # What fetch leaves behind when the connection drops part way.
+    download._part_path(path).write_bytes(data)
+    download._meta_path(path).write_text(json.dumps({"url": url, "partial": {"etag": etag, "last_modified": None}}))
+
+
+def test_resume():
+    body = b"".join(b"%d,row\n" % i for i in range(1000))
+    with tempfile.TemporaryDirectory() as directory, serving(body, '"v1"') as url:
+        path = pathlib.Path(directory) / "contributions.csv"
+        interrupted(path, url, body[:1234], '"v1"')
+        assert download.fetch(url, path) == "resumed"
+        assert Resource.requests[-1]["Range"] == "bytes=1234-"
+        assert path.read_bytes() == body
+        assert not download._part_path(path).exists()
+        assert download.fetch(url, path) == "unchanged"
+
+
+def test_changed_etag_restarts():
+    old = b"".join(b"%d,old\n" % i for i in range(1000))
+    new = b"".join(b"%d,new\n" % i for i in range(1000))
+    with tempfile.TemporaryDirectory() as directory, serving(new, '"v2"') as url:
+        path = pathlib.Path(directory) / "contributions.csv"
+        interrupted(path, url, old[:1234], '"v1"')
+        assert download.fetch(url, path) == "downloaded"
+        assert Resource.requests[-1]["If-Range"] == '"v1"'
+        assert path.read_bytes() == new
+        assert json.loads(download._meta_path(path).read_text())["etag"] == '"v2"'
+
+
+def test_truncated_keeps_old_copy():
+    with tempfile.TemporaryDirectory() as directory, serving(b"x" * 100000, '"v2"') as url:
+        directory = pathlib.Path(directory)
+        (directory / "contributions.csv").write_bytes(b"old copy")
+        Resource.truncate = 1000
+        assert download.fetch_all({"contributions.csv": url}, directory) == {"contributions.csv": "failed"}
+        assert (directory / "contributions.csv").read_bytes() == b"old copy"
+        # The next run picks up where this one stopped.
+        Resource.truncate = 0
+        assert download.fetch(url, directory / "contributions.csv") == "resumed"
+        assert Resource.requests[-1]["Range"] == "bytes=99000-"
+        assert (directory / "contributions.csv").read_bytes() == b"x" * 100000
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "passed")
@@ -0,0 +1,32 @@
+import pathlib
+import sqlite3
+import tempfile
+
+import export
+
+# Columns ingest couldn't convert keep their text, which parquet can't store
+# in an integer column.
+
+
+def test_unconverted_values_export_as_null():
+    con = sqlite3.connect(":memory:")
+    con.execute("CREATE TABLE contributions (id INTEGER, election_year INTEGER, amount REAL, contributor_zip INTEGER, receipt_date INTEGER)")
+    con.executemany("INSERT INTO contributions VALUES (?, ?, ?, ?, ?)", [
+        (1, 2022, 10.5, 98107, "2022-01-02"),
+        (2, 2022, "N/A", "98107-1234", "2022-01-03"),
+        (3, 2021, 5, None, "13/45/2021"),
+    ])
+    with tempfile.TemporaryDirectory() as directory:
+        assert export.export_table(con, "contributions", pathlib.Path(directory) / "contributions") == (3, 2)
+        df = export.read_table("contributions", directory=directory).sort_values("id")
+    assert df["contributor_zip"].tolist()[0] == 98107
+    assert df["contributor_zip"].isna().tolist() == [False, True, True]
+    assert df["amount"].isna().tolist() == [False, True, False]
+    assert df["receipt_date"].tolist() == ["2022-01-02", "2022-01-03", "13/45/2021"]
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "passed")
@@ -0,0 +1,63 @@
+import asyncio
+import pathlib
+import sqlite3
+import tempfile
+
+from datasette.app import Datasette
+
+# Table views of the raw database link lookup ids to the pages for the
+# names behind them.
+
+REPO = pathlib.Path(__file__).resolve().parent
+
+
+def make_db(path):
+    con = sqlite3.connect(path)
+    con.executescript("""
+        CREATE TABLE contributions_contributor_name (id INTEGER PRIMARY KEY, contributor_name TEXT);
+        CREATE TABLE contributions_contributor_employer_name (id INTEGER PRIMARY KEY, contributor_employer_name TEXT);
+        CREATE TABLE contributions (rowid INTEGER PRIMARY KEY, amount REAL,
+            contributor_name_id INTEGER REFERENCES contributions_contributor_name(id),
+            contributor_employer_name_id INTEGER REFERENCES contributions_contributor_employer_name(id));
+        CREATE TABLE contributor_year_totals (contributor_name_id INTEGER, year TEXT, total REAL);
+        INSERT INTO contributions_contributor_name VALUES (7, 'SMITH JANE & CO');
+        INSERT INTO contributions_contributor_employer_name VALUES (3, 'ACME');
+        INSERT INTO contributions VALUES (1, 25.0, 7, 3);
+        INSERT INTO contributor_year_totals VALUES (7, '2024', 25.0);
+    """)
+    con.commit()
+    con.close()
+
+
+def fetch(path, table):
+    async def get():
+        datasette = Datasette([str(path)], plugins_dir=str(REPO / "plugins"))
+        await datasette.invoke_startup()
+        response = await datasette.client.get(f"/raw/{table}")
+        assert response.status_code == 200, response.text
+        return response.text
+    return asyncio.run(get())
+
+
+def test_expanded_foreign_keys():
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory) / "raw.db"
+        make_db(path)
+        html = fetch(path, "contributions")
+        assert '<a href="/donor/SMITH%20JANE%20%26%20CO">SMITH JANE &amp; CO</a>' in html
+        assert '<a href="/employer/ACME">ACME</a>' in html
+
+
+def test_rollup_ids():
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory) / "raw.db"
+        make_db(path)
+        html = fetch(path, "contributor_year_totals")
+        assert '<a href="/donor/SMITH%20JANE%20%26%20CO">SMITH JANE &amp; CO</a>' in html
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "passed")
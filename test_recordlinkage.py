@@ -1,19 +1,36 @@
+import argparse
+import os
 import pandas
 import sqlite3
 import recordlinkage
 import time
 import pathlib
+
+import blocking
+import feature_cache
+import similarity
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--zip", default="98107", help="Zip code to dedupe, or all for the whole state")
+args = parser.parse_args()
+
 con = sqlite3.connect("file:/home/tannewt/repos/campaign-funds.org/raw.db?mode=ro", uri=True)
-df = pandas.read_sql_query("SELECT rowid, contributor_name, contributor_address, count(*) as num FROM contributions WHERE contributor_zip = 98107 GROUP BY contributor_name, contributor_address ORDER BY num DESC", con, index_col="rowid")
+if args.zip == "all":
+    df = pandas.read_sql_query("SELECT rowid, contributor_name, contributor_address, count(*) as num FROM contributions_named GROUP BY contributor_name, contributor_address ORDER BY num DESC", con, index_col="rowid")
+else:
+    df = pandas.read_sql_query("SELECT rowid, contributor_name, contributor_address, count(*) as num FROM contributions_named WHERE contributor_zip = ? GROUP BY contributor_name, contributor_address ORDER BY num DESC", con, index_col="rowid", params=(int(args.zip),))
 print(df)
 
-indexer = recordlinkage.Index()
-indexer.full()
-candidates = indexer.index(df)
+golden_paths = sorted(pathlib.Path("golden_data").iterdir())
+
+start = time.monotonic()
+candidates = blocking.candidates(df)
+print("blocking took", time.monotonic() - start)
+blocking.report(candidates, len(df), golden_paths)
 
 print(candidates)
 
-compare = recordlinkage.Compare()
+compare = similarity.Compare(jobs=os.cpu_count())
 compare.string("contributor_name", "contributor_name", method="levenshtein", label="contributor_name_lev")
 compare.string("contributor_name", "contributor_name", method="jarowinkler", label="contributor_name_jw")
 compare.string("contributor_address", "contributor_address", method="levenshtein", label="contributor_address_lev")
@@ -21,22 +38,11 @@ compare.string("contributor_address", "contributor_address", method="levenshtein
 # compare.string("contributor_city", "contributor_city", label="contributor_city")
 # compare.exact("contributor_zip", "contributor_zip", label="contributor_zip", missing_value=1)
 
-stored = pathlib.Path("compare_numbers.feather")
 start = time.monotonic()
-if stored.exists():
-    print("loading cached comparison numbers")
-    features = pandas.read_feather("compare_numbers.feather", columns=["rowid_1", "rowid_2", "contributor_name_lev", "contributor_name_jw", "contributor_address_lev"])
-    print(features)
-    features.set_index(["rowid_1", "rowid_2"], inplace=True)
-    print(features)
-else:
-    print("comparing")
-    features = compare.compute(candidates, df)
+features = feature_cache.FeatureCache().compute(compare, candidates, df, index_params={"blocking": blocking.SORTED_NEIGHBOURHOOD_WINDOW})
 duration = time.monotonic() - start
 
-features.reset_index().to_feather("compare_numbers.feather")
-
-golden_data = pathlib.Path("golden_data").iterdir()
+golden_data = golden_paths
 if not golden_data:
     connected = recordlinkage.ConnectedComponents()
     matches = features[features.sum(axis=1) > 2.5]
@@ -55,14 +61,16 @@ else:
     for path in golden_data:
         print("loading", path)
         results = recordlinkage.read_annotation_file(path)
+        # Only the annotated pairs blocking kept have features.
+        links = blocking.align(results.links, candidates)
+        distinct = blocking.align(results.distinct, candidates)
         if sample is None:
-            matches = results.links.to_frame()
-            sample = results.distinct
-            sample = pandas.concat((features.loc[results.distinct], features.loc[results.links]))
+            matches = links.to_frame()
+            sample = pandas.concat((features.loc[distinct], features.loc[links]))
             print(sample)
         else:
-            sample = pandas.concat((sample, features.loc[results.distinct], features.loc[results.links]))
-            matches = pandas.concat((matches, results.links.to_frame()))
+            sample = pandas.concat((sample, features.loc[distinct], features.loc[links]))
+            matches = pandas.concat((matches, links.to_frame()))
         #     matches.append(results.links)
         #     sample.append(results.distinct)
     print(sample)
@@ -0,0 +1,66 @@
+import sqlite3
+
+import site_data
+
+# The thresholds have to apply to the total over every year, so each check
+# compares against a plain GROUP BY summed up in Python.
+
+YEARS = (2020, 2021, 2022)
+
+
+def year_totals(db, table, column, totals):
+    db.execute(f"CREATE TABLE {table} ({column}, year, total)")
+    for name, per_year in totals.items():
+        db.executemany(f"INSERT INTO {table} VALUES (?, ?, ?)", [(name, year, total) for year, total in zip(YEARS, per_year)])
+
+
+def over(db, sql, threshold):
+    sums = {}
+    for name, total in db.execute(sql):
+        sums[name] = sums.get(name, 0) + total
+    return {name for name, total in sums.items() if total > threshold}
+
+
+def test_top_employers():
+    db = sqlite3.connect(":memory:")
+    # Every year under the threshold, the sum over it, and the other way
+    # around for the last year.
+    year_totals(db, "employer_year_totals", "contributor_employer_name", {
+        "AMAZON": (60000, 60000, 49000),
+        "NORDSTROM": (10000, 10000, 108000),
+        "SELF": (40000, 40000, 10000),
+        "A/B": (100000, 100000, 100000),
+    })
+    expected = over(db, "select contributor_employer_name, total from employer_year_totals where contributor_employer_name not like '%/%'", 100000)
+    assert expected == {"AMAZON", "NORDSTROM"}
+    assert site_data.top_employers(db, 100000) == expected
+
+
+def test_vip_contributors():
+    db = sqlite3.connect(":memory:")
+    year_totals(db, "contributor_year_totals", "contributor_name", {
+        "JASON NGUYEN": (20000, 20000, 20000),
+        "KEVIN TURNER": (5000, 5000, 45000),
+        "PAT SMITH": (60000, 0, 0),
+        "LEE JONES": (10000, 10000, 10000),
+    })
+    expected = over(db, "select contributor_name, total from contributor_year_totals", 50000)
+    assert expected == {"JASON NGUYEN", "KEVIN TURNER", "PAT SMITH"}
+    assert site_data.vip_contributors(db) == expected
+
+
+def test_canonical_vip_contributors():
+    db = sqlite3.connect(":memory:")
+    year_totals(db, "donor_year_totals", "donor_id", {1: (20000, 20000, 20000), 2: (5000, 5000, 45000), 3: (10000, 10000, 10000)})
+    db.execute("CREATE TABLE donors (donor_id, contributor_name)")
+    db.executemany("INSERT INTO donors VALUES (?, ?)", [(1, "JASON NGUYEN"), (2, "KEVIN TURNER"), (3, "LEE JONES")])
+    expected = over(db, "select contributor_name, total from donor_year_totals, donors where donors.donor_id = donor_year_totals.donor_id", 50000)
+    assert expected == {"JASON NGUYEN", "KEVIN TURNER"}
+    assert site_data.canonical_vip_contributors(db) == expected
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "passed")
@@ -1,10 +1,13 @@
-import csv
+import argparse
 import pathlib
-import urllib.request
-import progressbar
-from datetime import datetime
-import dateutil.parser
-import functools
+import sqlite3
+
+import download
+import entities
+import export
+import indexes
+import ingest
+import rollups
 
 build = pathlib.Path("build")
 
@@ -15,110 +18,44 @@ source_csvs = {
     "seattle.csv": "http://web6.seattle.gov/ethics/elections/returnList.ashx?yearElection=2021&strWhichList=alltransactions&strFormat=csv"
 }
 
-for source in source_csvs:
-    if not (build / source).exists():
-        print("Downloading", source)
-        urllib.request.urlretrieve(source_csvs[source], build / source)
+parser = argparse.ArgumentParser()
+parser.add_argument("--incremental", action="store_true", help="Only apply rows that changed since the last run instead of rebuilding raw.db")
+parser.add_argument("--no-download", action="store_true", help="Use the CSVs already in build/")
+parser.add_argument("--export-parquet", action="store_true", help="Also write the tables to build/parquet for match_exp_cont.py --parquet")
+args = parser.parse_args()
+
+if not args.no_download:
+    download.fetch_all(source_csvs, build)
 
 # post-process
 
-import sqlite3
 con = sqlite3.connect('raw.db')
-c = con.cursor()
+ingest.set_pragmas(con, ingest.INGEST_PRAGMAS)
 
-INT_ROWS = ("id", "report_number", "committee_zip", "party_code", "committee_id", "election_year", "recipient_zip", "treasurer_zip", "contributor_zip")
-DATE_ROWS = ("expenditure_date", "receipt_date")
-FLOAT_ROWS = ("amount",)
-EXTRACT_ROWS = ("party", "filer_type", "origin", "filer_name", "type", "cash_or_in_kind", "code", "contributor_category", "primary_general", "itemized_or_non_itemized")
+stats = {}
+for filename in source_csvs:
+    print("Processing", filename)
+    table = filename.split(".")[0]
+    stats[table] = ingest.load_csv(con, table, build / filename, incremental=args.incremental, track=rollups.KEY_COLUMNS)
 
-PRINT_BAD_VALUES = False
+indexes.build_indexes(con, stats)
 
-@functools.lru_cache(len(EXTRACT_ROWS) * 16)
-def get_id(table, field, value):
-    c.execute(f"SELECT id FROM [{table}_{field}] WHERE [{field}]=?", (value,))
-    r = c.fetchone()
-    if r is None:
-        c.execute(f"INSERT INTO [{table}_{field}]([{field}]) VALUES (?)", (value,))
-        c.execute(f"SELECT id FROM [{table}_{field}] WHERE [{field}]=?", (value,))
-        r = c.fetchone()
-    return r[0]
+if args.incremental and not stats["contributions"].get("rebuilt") and rollups.can_refresh(con):
+    rollups.refresh_rollups(con, stats["contributions"]["affected"])
+else:
+    rollups.build_rollups(con)
 
-@functools.lru_cache(len(DATE_ROWS) * 256)
-def parse_date(value):
-    d = dateutil.parser.parse(value)
-    if d is None:
-        print(value)
-    return d.date().isoformat()
+indexes.build_indexes(con, rollups.ROLLUPS)
 
-for filename in source_csvs:
-    path = build / filename
-    print("Processing", filename)
-    with path.open(newline='') as f:
-        reader = csv.reader(f)
-        row_count = 0
-        for row in reader:
-            row_count += 1
-        print(row_count)
-        f.seek(0)
-        reader = csv.DictReader(f)
-        fields = []
-        inserts = []
-        cols = []
-        table = filename.split(".")[0]
-        for field in reader.fieldnames:
-            t = "TEXT"
-            col = field
-            if field in INT_ROWS or field in DATE_ROWS:
-                t = "INTEGER"
-            elif field in FLOAT_ROWS:
-                t = "REAL"
-            elif field in EXTRACT_ROWS:
-                con.execute(f"CREATE TABLE [{table}_{field}] ([id] INTEGER PRIMARY KEY, [{field}] TEXT)")
-                con.execute(f"CREATE UNIQUE INDEX [idx_{table}_{field}_{field}] ON [{table}_{field}] ([{field}])")
-                t = f"INTEGER REFERENCES [{table}_{field}]([id])"
-                col = f"{field}_id"
-            fields.append(f"[{col}] {t}")
-            cols.append(f"[{col}]")
-            inserts.append(f":{field}")
-        fields = ", ".join(fields)
-        cols = ", ".join(cols)
-        inserts = ", ".join(inserts)
-        #print(f"CREATE TABLE [{table}] ([rowid] INTEGER PRIMARY KEY, {fields})")
-        con.execute(f"CREATE TABLE [{table}] ([rowid] INTEGER PRIMARY KEY, {fields})")
-        con.commit()
-        insert_sql = f"INSERT INTO [{table}]({cols}) VALUES ({inserts})"
-        i = 0
-        with progressbar.ProgressBar(max_value=row_count, redirect_stdout=True) as bar:
-            for row in bar(reader):
-                for k in row:
-                    try:
-                        if row[k] == '':
-                            row[k] = None
-                        elif k in INT_ROWS:
-                            row[k] = int(row[k])
-                        elif k in FLOAT_ROWS:
-                            row[k] = float(row[k])
-                        elif k in DATE_ROWS:
-                            row[k] = parse_date(row[k])
-                        elif k in EXTRACT_ROWS:
-                            row[k] = get_id(table, k, row[k])
-                        elif row[k] is not None:
-                            row[k] = row[k].upper()
-                            if "address" in k:
-                                row[k] = row[k].replace(".", "")
+# Needs dedupe_runner.py to have been run at least once. Rebuilt in full
+# since contributions may have moved between donors.
+if entities.build_entities(con):
+    indexes.build_indexes(con, entities.ENTITY_TABLES)
 
-                        # print(k, repr(row[k]))
-                    except ValueError as e:
-                        if PRINT_BAD_VALUES:
-                            print(k, row[k], e)
-                con.execute(insert_sql, row)
-                if i % 10000 == 0:
-                    con.commit()
-                i += 1
-                #break
+indexes.analyze(con)
 
-con.execute("CREATE TABLE contribution_totals AS SELECT contributor_name, code_id, election_year, SUM(amount) as total_amount FROM contributions GROUP BY contributor_name, election_year")
-con.commit()
+if args.export_parquet:
+    export.export_tables(con, build / "parquet", skip=[table for table in export.TABLES if stats[table].get("skipped")])
 
-con.commit()
+ingest.set_pragmas(con, ingest.DEFAULT_PRAGMAS)
 con.close()